@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the engine hot paths.
+
+Usage: python benchmarks/run.py [NAME...] [--rounds N] [--output PATH]
+
+Every benchmark is run for a number of rounds (at least 3), each on a
+fresh setup, and only the best round counts. The results are compared against the stored
+baseline (benchmarks/baseline.json): the run fails when a benchmark is
+slower than its baseline by more than the threshold (10% by default,
+configurable globally or per benchmark with --threshold [NAME=]RATIO).
+Run with --save-baseline to record a new baseline, on the same machine the
+comparisons will be run on.
+"""
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+from argparse import ArgumentParser
+from collections import OrderedDict
+from time import perf_counter
+
+BASEDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASEDIR)
+
+import fireplace
+from fireplace import cards
+from fireplace.cards.heroes import MAGE, WARRIOR
+from fireplace.dsl.selector import (
+	ALL_CHARACTERS, ALL_MINIONS, DAMAGED_CHARACTERS, ENEMY_CHARACTERS, FRIENDLY_MINIONS, SELF
+)
+from fireplace.enums import CardClass, CardType, Race, Rarity
+from fireplace.game import Game
+from fireplace.player import Player
+from fireplace.simulate import play_game
+from fireplace.utils import random_draft
+
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.1
+MIN_ROUNDS = 3
+# Number of boards set up for the benchmarks consuming them
+BOARDS = 10
+
+WISP = "CS2_231"
+CHILLWIND_YETI = "CS2_182"
+HAUNTED_CREEPER = "FP1_002"
+RAID_LEADER = "CS2_122"
+STORMWIND_CHAMPION = "CS2_222"
+UNSTABLE_GHOUL = "FP1_024"
+WHIRLWIND = "EX1_400"
+
+# Maps benchmark names to their setup function, see benchmark()
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(func):
+	"""
+	Register \a func as a benchmark. \a func sets up a round and returns the
+	callable to time. If that callable returns a number, it is used as the
+	duration of the round instead.
+	"""
+	BENCHMARKS[func.__name__] = func
+	return func
+
+
+def _board(minions1, minions2):
+	"""
+	Returns a started game with \a minions1 and \a minions2 summoned for
+	each player, and 10 mana for the first player.
+	"""
+	players = (Player("Player1"), Player("Player2"))
+	for player in players:
+		player.prepare_deck([WISP] * 30, MAGE)
+	game = Game(players=players, seed=0)
+	game.headless = True
+	game.start()
+	for player in players:
+		player.choice.choose()
+	for player, minions in zip(players, (minions1, minions2)):
+		for id in minions:
+			player.summon(id)
+	game.player1.max_mana = 10
+	return game
+
+
+@benchmark
+def full_games():
+	rng = random.Random(0)
+	deck1, deck2 = random_draft(MAGE, rng=rng), random_draft(WARRIOR, rng=rng)
+
+	def run():
+		for seed in range(10):
+			play_game(deck1, MAGE, deck2, WARRIOR, seed)
+	return run
+
+
+@benchmark
+def auras():
+	board = [STORMWIND_CHAMPION] * 4 + [RAID_LEADER] * 2
+	game = _board(board, board)
+	minions = game.player1.field + game.player2.field
+
+	def run():
+		# A Raid Leader comes and goes next to 12 minions under auras: the
+		# auras update their targets on both changes of the board
+		for i in range(50):
+			game.player1.summon(RAID_LEADER).destroy()
+			for minion in minions:
+				minion.atk
+				minion.health
+	return run
+
+
+@benchmark
+def aoe_damage():
+	games = [_board([CHILLWIND_YETI] * 7, [CHILLWIND_YETI] * 7) for i in range(BOARDS)]
+
+	def run():
+		# Four Whirlwinds on 14 minions with 5 health: no deaths
+		for game in games:
+			for i in range(4):
+				game.player1.give(WHIRLWIND).play()
+	return run
+
+
+@benchmark
+def deathrattle_chain():
+	games = [_board([UNSTABLE_GHOUL] * 7, [HAUNTED_CREEPER] * 7) for i in range(BOARDS)]
+
+	def run():
+		# The Creepers die on the second Whirlwind and their spiders fill
+		# the board, the Ghouls die on the third and their deathrattles
+		# kill the spiders.
+		for game in games:
+			for i in range(3):
+				game.player1.give(WHIRLWIND).play()
+	return run
+
+
+@benchmark
+def selectors():
+	game = _board([CHILLWIND_YETI] * 7, [CHILLWIND_YETI] * 7)
+	game.player1.give(WHIRLWIND).play()
+	source = game.player1.field[0]
+	selectors = (
+		ALL_MINIONS, ALL_CHARACTERS, ENEMY_CHARACTERS, DAMAGED_CHARACTERS,
+		FRIENDLY_MINIONS - SELF,
+	)
+
+	def run():
+		for i in range(500):
+			for selector in selectors:
+				selector.eval(game, source)
+	return run
+
+
+@benchmark
+def card_filter():
+	queries = (
+		{"collectible": True},
+		{"collectible": True, "type": CardType.MINION},
+		{"collectible": True, "card_class": CardClass.MAGE},
+		{"collectible": True, "rarity": Rarity.LEGENDARY},
+		{"type": CardType.MINION, "race": Race.BEAST},
+		{"type": CardType.SPELL, "cost": 2},
+		{"collectible": True, "name": "Wisp"},
+	)
+
+	def run():
+		for i in range(20):
+			# Time the lookups, not their memoization
+			cards._filter_cache.clear()
+			for query in queries:
+				cards.filter(**query)
+	return run
+
+
+@benchmark
+def card_db_import():
+	code = (
+		"from time import perf_counter; start = perf_counter(); "
+		"import fireplace.cards; fireplace.cards.db[%r]; "
+		"print(perf_counter() - start)" % (WISP)
+	)
+
+	def run():
+		# Measured in a fresh interpreter, without its own startup time
+		output = subprocess.check_output([sys.executable, "-c", code], cwd=BASEDIR)
+		return float(output)
+	return run
+
+
+def measure(name, rounds):
+	times = []
+	for i in range(rounds):
+		run = BENCHMARKS[name]()
+		start = perf_counter()
+		duration = run()
+		if duration is None:
+			duration = perf_counter() - start
+		times.append(duration)
+	return {"best": min(times), "mean": sum(times) / len(times), "rounds": rounds}
+
+
+def compare(results, baseline, thresholds):
+	"""
+	Returns the names of the benchmarks of \a results slower than in
+	\a baseline by more than their threshold, and prints the comparison.
+	"""
+	regressions = []
+	print("%-20s %12s %12s %8s" % ("benchmark", "baseline (ms)", "current (ms)", "change"))
+	for name, result in results.items():
+		if name not in baseline:
+			print("%-20s %12s %12.2f %8s" % (name, "-", result["best"] * 1000, "new"))
+			continue
+		expected = baseline[name]["best"]
+		change = result["best"] / expected - 1
+		threshold = thresholds.get(name, thresholds[None])
+		status = ""
+		if change > threshold:
+			regressions.append(name)
+			status = "REGRESSION (> %+.0f%%)" % (threshold * 100)
+		print("%-20s %12.2f %12.2f %+7.1f%% %s" % (
+			name, expected * 1000, result["best"] * 1000, change * 100, status
+		))
+	return regressions
+
+
+def _thresholds(values):
+	ret = {None: DEFAULT_THRESHOLD}
+	for value in values:
+		name, _, ratio = value.rpartition("=")
+		if name and name not in BENCHMARKS:
+			raise ValueError("Unknown benchmark: %r" % (name))
+		ret[name or None] = float(ratio)
+	return ret
+
+
+def main():
+	arguments = ArgumentParser(prog="benchmarks/run.py")
+	arguments.add_argument("benchmarks", nargs="*", metavar="NAME",
+		help="Benchmarks to run (default: all of %s)" % (", ".join(BENCHMARKS)))
+	arguments.add_argument("-r", "--rounds", type=int, default=5)
+	arguments.add_argument("-o", "--output", metavar="PATH", help="Write the results to PATH, as JSON")
+	arguments.add_argument("--baseline", metavar="PATH", default=BASELINE)
+	arguments.add_argument("--threshold", metavar="[NAME=]RATIO", action="append", default=[],
+		help="Allowed slowdown, eg. 0.1 for 10%%, for all or one benchmark")
+	arguments.add_argument("--save-baseline", action="store_true",
+		help="Store the results as the new baseline instead of comparing them")
+	args = arguments.parse_args(sys.argv[1:])
+
+	for name in args.benchmarks:
+		if name not in BENCHMARKS:
+			arguments.error("unknown benchmark: %r" % (name))
+	if args.rounds < MIN_ROUNDS:
+		# The best of fewer rounds varies too much to compare
+		arguments.error("--rounds must be at least %i" % (MIN_ROUNDS))
+	try:
+		thresholds = _thresholds(args.threshold)
+	except ValueError as e:
+		arguments.error(str(e))
+	logging.getLogger("fireplace").setLevel(logging.WARNING)
+
+	results = OrderedDict()
+	for name in args.benchmarks or BENCHMARKS:
+		results[name] = measure(name, args.rounds)
+		sys.stderr.write("%s: %.2f ms\n" % (name, results[name]["best"] * 1000))
+
+	report = {
+		"fireplace": fireplace.__version__,
+		"python": platform.python_version(),
+		"machine": platform.machine(),
+		"benchmarks": results,
+	}
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(report, f, indent="\t")
+
+	if args.save_baseline:
+		if os.path.exists(args.baseline):
+			with open(args.baseline, "r") as f:
+				previous = json.load(f)["benchmarks"]
+			# Keep the baseline of the benchmarks which were not run
+			previous.update(results)
+			report["benchmarks"] = previous
+		with open(args.baseline, "w") as f:
+			json.dump(report, f, indent="\t")
+			f.write("\n")
+		return 0
+
+	if not os.path.exists(args.baseline):
+		sys.stderr.write("No baseline at %s, run with --save-baseline\n" % (args.baseline))
+		return 0
+	with open(args.baseline, "r") as f:
+		baseline = json.load(f)["benchmarks"]
+	regressions = compare(results, baseline, thresholds)
+	if regressions:
+		sys.stderr.write("%i benchmark(s) regressed: %s\n" % (len(regressions), ", ".join(regressions)))
+		return 1
+	return 0
+
+
+if __name__ == "__main__":
+	exit(main())
@@ -1,8 +1,8 @@
 from enum import IntEnum
+from types import GeneratorType
 from .dsl import LazyNum, Picker, Selector
 from .enums import CardType, Mulligan, PowSubType, Zone
 from .entity import Entity
-from .utils import fireplace_logger as logger
 
 
 def _eval_card(source, card):
@@ -31,6 +31,43 @@ def _eval_card(source, card):
 	return ret
 
 
+def resolve(task):
+	"""
+	Run \a task to completion and return its result.
+	A task is a generator which yields the tasks it depends on, and
+	receives their results in return. Instead of recursing through the
+	Python stack, nested tasks are run from an explicit stack, in the same
+	order as they would be called. Yielding None is a no-op.
+	"""
+	stack = [task]
+	send = task.send
+	value = None
+	while True:
+		try:
+			subtask = send(value)
+		except StopIteration as e:
+			stack.pop()
+			if not stack:
+				return e.value
+			send = stack[-1].send
+			value = e.value
+			continue
+		except BaseException as e:
+			stack.pop()
+			if not stack:
+				raise
+			# Raise it in the parent task, where it would have been raised
+			send = stack[-1].throw
+			value = e
+			continue
+		value = None
+		if subtask is None:
+			send = stack[-1].send
+		else:
+			stack.append(subtask)
+			send = subtask.send
+
+
 class EventListener:
 	ON = 1
 	AFTER = 2
@@ -45,6 +82,10 @@ class EventListener:
 		return "<EventListener %r>" % (self.trigger)
 
 
+# Maps Action.Args classes to the names of their members, in order
+_argnames = {}
+
+
 class Action:  # Lawsuit
 	type = PowSubType.TRIGGER
 
@@ -57,9 +98,10 @@ class Action:  # Lawsuit
 
 	def __init__(self, *args, **kwargs):
 		self._args = args
-		self._argnames = []
-		for e, arg in zip(self.Args, self._args):
-			self._argnames.append(e.name)
+		names = _argnames.get(self.Args)
+		if names is None:
+			names = _argnames[self.Args] = tuple(e.name for e in self.Args)
+		self._argnames = names[:len(args)]
 
 	def __repr__(self):
 		args = ["%s=%r" % (k, v) for k, v in zip(self._argnames, self._args)]
@@ -71,24 +113,42 @@ class Action:  # Lawsuit
 	def on(self, *actions):
 		return EventListener(self, actions, EventListener.ON)
 
-	def _broadcast(self, entity, source, at, *args):
+	def _broadcast_to(self, entity, source, at, *args):
 		for event in entity.events:
 			if event.at != at:
 				continue
 			if isinstance(event.trigger, self.__class__) and event.trigger.matches(entity, args):
-				logger.info("%r triggers off %r from %r", entity, self, source)
-				entity.trigger_event(source, event, args)
+				source.log("%r triggers off %r from %r", entity, self, source)
+				yield entity._trigger_event(source, event, args)
 
-	def broadcast(self, source, at, *args):
-		for entity in source.game.entities:
-			self._broadcast(entity, source, at, *args)
+	def _broadcast(self, source, at, *args):
+		"""
+		Returns the task broadcasting the action to its listeners, or None
+		if nothing listens to it.
+		"""
+		game = source.game
+		if not game._listeners.get((self.__class__, at)):
+			return None
+		return self._broadcast_listeners(game, source, at, args)
+
+	def _broadcast_listeners(self, game, source, at, args):
+		for entity in game.get_listeners(self.__class__, at):
+			yield self._broadcast_to(entity, source, at, *args)
 
-		for entity in source.game.hands:
-			self._broadcast(entity, source, at, *args)
+		for entity in game.get_listeners(self.__class__, at, hands=True):
+			yield self._broadcast_to(entity, source, at, *args)
+
+	def broadcast(self, source, at, *args):
+		task = self._broadcast(source, at, *args)
+		if task is not None:
+			resolve(task)
 
 	def get_args(self, source):
 		return self._args
 
+	def trigger(self, source):
+		return resolve(self._trigger(source))
+
 	def matches(self, source, args):
 		for arg, match in zip(args, self._args):
 			if match is None:
@@ -102,12 +162,15 @@ class Action:  # Lawsuit
 
 
 class GameAction(Action):
-	def trigger(self, source):
+	def _trigger(self, source):
+		game = source.game
 		args = self.get_args(source)
-		source.game.manager.action(self.type, source, *args)
-		self.do(source, *args)
-		source.game.manager.action_end(self.type, source, *args)
-		source.game.process_deaths()
+		game.manager.action(self, source, *args)
+		ret = self.do(source, *args)
+		if type(ret) is GeneratorType:
+			yield ret
+		game.manager.action_end(self, source, *args)
+		yield game._process_deaths()
 
 
 class Attack(GameAction):
@@ -129,9 +192,9 @@ class Attack(GameAction):
 		defender.defending = True
 		source.game.proposed_attacker = attacker
 		source.game.proposed_defender = defender
-		logger.info("%r attacks %r", attacker, defender)
-		self.broadcast(source, EventListener.ON, attacker, defender)
-		source.game._attack()
+		source.log("%r attacks %r", attacker, defender)
+		yield self._broadcast(source, EventListener.ON, attacker, defender)
+		yield source.game._attack()
 
 
 class BeginTurn(GameAction):
@@ -144,7 +207,7 @@ class BeginTurn(GameAction):
 	type = None
 
 	def do(self, source, player):
-		self.broadcast(source, EventListener.ON, player)
+		yield self._broadcast(source, EventListener.ON, player)
 		source.game._begin_turn(player)
 
 
@@ -154,7 +217,7 @@ class Deaths(GameAction):
 	"""
 
 	def do(self, source, *args):
-		source.game.process_deaths()
+		return source.game._process_deaths()
 
 
 class Death(GameAction):
@@ -165,10 +228,10 @@ class Death(GameAction):
 		ENTITY = 0
 
 	def do(self, source, target):
-		logger.info("Processing Death for %r", target)
-		self.broadcast(source, EventListener.ON, target)
+		source.log("Processing Death for %r", target)
+		yield self._broadcast(source, EventListener.ON, target)
 		if target.deathrattles:
-			source.game.queue_actions(source, [Deathrattle(target)])
+			yield source.game._queue_actions(source, [Deathrattle(target)])
 
 
 class EndTurn(GameAction):
@@ -182,7 +245,7 @@ class EndTurn(GameAction):
 
 	def do(self, source, player):
 		assert not player.choice, "Attempted to end a turn with a choice open"
-		self.broadcast(source, EventListener.ON, player)
+		yield self._broadcast(source, EventListener.ON, player)
 		source.game._end_turn()
 
 
@@ -223,11 +286,11 @@ class Play(GameAction):
 
 	type = PowSubType.PLAY
 
-	def _broadcast(self, entity, source, at, *args):
+	def _broadcast_to(self, entity, source, at, *args):
 		# Prevent cards from triggering off their own play
 		if entity is args[1]:
-			return
-		return super()._broadcast(entity, source, at, *args)
+			return None
+		return super()._broadcast_to(entity, source, at, *args)
 
 	def get_args(self, source):
 		return (source, ) + super().get_args(source)
@@ -238,7 +301,7 @@ class Play(GameAction):
 		if choose is not None:
 			# Choose One cards replace the action on the played card
 			chosen = player.card(choose)
-			logger.info("Choose One from %r: %r", card, chosen)
+			source.log("Choose One from %r: %r", card, chosen)
 			if chosen.has_target():
 				chosen.target = target
 			card.chosen = chosen
@@ -249,12 +312,12 @@ class Play(GameAction):
 		# NOTE: A Play is not a summon! But it sure looks like one.
 		# We need to fake a Summon broadcast.
 		summon_action = Summon(player, card)
-		self.broadcast(player, EventListener.ON, player, card, target, choose)
-		summon_action.broadcast(player, EventListener.ON, player, card)
+		yield self._broadcast(player, EventListener.ON, player, card, target, choose)
+		yield summon_action._broadcast(player, EventListener.ON, player, card)
 		player.game.no_aura_refresh = False
-		card.action()
-		summon_action.broadcast(player, EventListener.AFTER, player, card)
-		self.broadcast(player, EventListener.AFTER, player, card, target, choose)
+		yield card._action()
+		yield summon_action._broadcast(player, EventListener.AFTER, player, card)
+		yield self._broadcast(player, EventListener.AFTER, player, card, target, choose)
 		player.combo = True
 		player.cards_played_this_turn += 1
 		if card.type == CardType.MINION:
@@ -289,8 +352,8 @@ class TargetedAction(Action):
 
 	def get_target_args(self, source, target):
 		ret = []
-		for k, v in zip(self.Args, self._args):
-			if k.name == "TARGETS":
+		for k, v in zip(self._argnames, self._args):
+			if k == "TARGETS":
 				continue
 			elif isinstance(v, Selector):
 				# evaluate Selector arguments
@@ -305,7 +368,7 @@ class TargetedAction(Action):
 			elif isinstance(v, LazyNum):
 				# evaluate LazyNum arguments into ints
 				v = v.evaluate(source)
-			elif k.name == "CARDS":
+			elif k == "CARDS":
 				# HACK: card-likes are always named Args.CARDS
 				v = _eval_card(source, v)
 			ret.append(v)
@@ -322,7 +385,7 @@ class TargetedAction(Action):
 		else:
 			return t.eval(source.game, source)
 
-	def trigger(self, source):
+	def _trigger(self, source):
 		ret = []
 
 		if self.source is not None:
@@ -334,16 +397,25 @@ class TargetedAction(Action):
 		if isinstance(times, LazyNum):
 			times = times.evaluate(source)
 
+		game = source.game
+		manager = game.manager
 		for i in range(times):
 			args = self.get_args(source)
-			targets = self.get_targets(source, args[0])
+			if isinstance(args[0], Action):
+				# See get_targets()
+				targets = (yield args[0]._trigger(source))[0]
+			else:
+				targets = self.get_targets(source, args[0])
 			args = args[1:]
-			source.game.manager.action(self.type, source, targets, *args)
-			logger.info("%r triggering %r targeting %r", source, self, targets)
+			manager.action(self, source, targets, *args)
+			source.log("%r triggering %r targeting %r", source, self, targets)
 			for target in targets:
 				target_args = self.get_target_args(source, target)
-				ret.append(self.do(source, target, *target_args))
-			source.game.manager.action_end(self.type, source, targets, *self._args)
+				value = self.do(source, target, *target_args)
+				if type(value) is GeneratorType:
+					value = yield value
+				ret.append(value)
+			manager.action_end(self, source, targets, *self._args)
 
 		return ret
 
@@ -387,7 +459,7 @@ class Damage(TargetedAction):
 	def do(self, source, target, amount):
 		amount = target._hit(source, amount)
 		if amount:
-			self.broadcast(source, EventListener.ON, target, amount, source)
+			return self._broadcast(source, EventListener.ON, target, amount, source)
 
 
 class Deathrattle(TargetedAction):
@@ -395,16 +467,24 @@ class Deathrattle(TargetedAction):
 	Trigger deathrattles on card targets.
 	"""
 	def do(self, source, target):
+		manager = source.game.manager
 		for deathrattle in target.deathrattles:
-			if callable(deathrattle):
-				actions = deathrattle(target)
-			else:
-				actions = deathrattle
-			source.game.queue_actions(target, actions)
-
-			if target.controller.extra_deathrattles:
-				logger.info("Triggering deathrattles for %r again", target)
-				source.game.queue_actions(target, actions)
+			tracing = manager.tracers
+			if tracing:
+				manager.trace("script:deathrattle", target.id, target)
+			try:
+				if callable(deathrattle):
+					actions = deathrattle(target)
+				else:
+					actions = deathrattle
+				yield source.game._queue_actions(target, actions)
+
+				if target.controller.extra_deathrattles:
+					source.log("Triggering deathrattles for %r again", target)
+					yield source.game._queue_actions(target, actions)
+			finally:
+				if tracing:
+					manager.trace_end("script:deathrattle", target.id, target)
 
 
 class Destroy(TargetedAction):
@@ -420,7 +500,7 @@ class Discard(TargetedAction):
 	Discard card targets in a player's hand
 	"""
 	def do(self, source, target):
-		self.broadcast(source, EventListener.ON, target)
+		yield self._broadcast(source, EventListener.ON, target)
 		target.discard()
 
 
@@ -438,7 +518,7 @@ class Draw(TargetedAction):
 			return []
 		card = target.deck[-1]
 		card.draw()
-		self.broadcast(source, EventListener.ON, target, card, source)
+		yield self._broadcast(source, EventListener.ON, target, card, source)
 
 		return [card]
 
@@ -469,7 +549,7 @@ class GainArmor(TargetedAction):
 
 	def do(self, source, target, amount):
 		target.armor += amount
-		self.broadcast(source, EventListener.ON, target, amount)
+		yield self._broadcast(source, EventListener.ON, target, amount)
 
 
 class GainMana(TargetedAction):
@@ -506,11 +586,11 @@ class Give(TargetedAction):
 		CARDS = 1
 
 	def do(self, source, target, cards):
-		logger.info("Giving %r to %s", cards, target)
+		source.log("Giving %r to %s", cards, target)
 		ret = []
 		for card in cards:
 			if len(target.hand) >= target.max_hand_size:
-				logger.info("Give(%r) fails because %r's hand is full", card, target)
+				source.log("Give(%r) fails because %r's hand is full", card, target)
 				continue
 			card.controller = target
 			card.zone = Zone.HAND
@@ -527,7 +607,7 @@ class Hit(TargetedAction):
 		AMOUNT = 1
 
 	def do(self, source, target, amount):
-		source.hit(target, amount)
+		return source._hit_target(target, amount)
 
 
 class Heal(TargetedAction):
@@ -541,15 +621,15 @@ class Heal(TargetedAction):
 	def do(self, source, target, amount):
 		if source.controller.outgoing_healing_adjustment:
 			# "healing as damage" (hack-ish)
-			return source.hit(target, amount)
+			return (yield source._hit_target(target, amount))
 
 		amount *= (source.controller.healing_double + 1)
 		amount = min(amount, target.damage)
 		if amount:
 			# Undamaged targets do not receive heals
-			logger.info("%r heals %r for %i", source, target, amount)
+			source.log("%r heals %r for %i", source, target, amount)
 			target.damage -= amount
-			self.broadcast(source, EventListener.ON, target, amount)
+			yield self._broadcast(source, EventListener.ON, target, amount)
 
 
 class ManaThisTurn(TargetedAction):
@@ -592,7 +672,7 @@ class Morph(TargetedAction):
 		return (card, )
 
 	def do(self, source, target, card):
-		logger.info("Morphing %r into %r", target, card)
+		source.log("Morphing %r into %r", target, card)
 		target.clear_buffs()
 		target.zone = Zone.SETASIDE
 		card.zone = Zone.PLAY
@@ -624,8 +704,8 @@ class Reveal(TargetedAction):
 	Reveal secret targets.
 	"""
 	def do(self, source, target):
-		logger.info("Revealing secret %r", target)
-		self.broadcast(source, EventListener.ON, target)
+		source.log("Revealing secret %r", target)
+		yield self._broadcast(source, EventListener.ON, target)
 		target.zone = Zone.GRAVEYARD
 
 
@@ -638,7 +718,7 @@ class SetCurrentHealth(TargetedAction):
 		AMOUNT = 1
 
 	def do(self, source, target, amount):
-		logger.info("Setting current health on %r to %i", target, amount)
+		source.log("Setting current health on %r to %i", target, amount)
 		maxhp = target.max_health
 		target.damage = max(0, maxhp - amount)
 
@@ -674,14 +754,14 @@ class Summon(TargetedAction):
 		TARGETS = 0
 		CARDS = 1
 
-	def _broadcast(self, entity, source, at, *args):
+	def _broadcast_to(self, entity, source, at, *args):
 		# Prevent cards from triggering off their own summon
 		if entity is args[1]:
-			return
-		return super()._broadcast(entity, source, at, *args)
+			return None
+		return super()._broadcast_to(entity, source, at, *args)
 
 	def do(self, source, target, cards):
-		logger.info("%s summons %r", target, cards)
+		source.log("%s summons %r", target, cards)
 		if not isinstance(cards, list):
 			cards = [cards]
 
@@ -690,10 +770,10 @@ class Summon(TargetedAction):
 				card.controller = target
 			if card.type == CardType.MINION and not target.minion_slots:
 				continue
-			self.broadcast(source, EventListener.ON, target, card)
+			yield self._broadcast(source, EventListener.ON, target, card)
 			if card.zone != Zone.PLAY:
 				card.zone = Zone.PLAY
-			self.broadcast(source, EventListener.AFTER, target, card)
+			yield self._broadcast(source, EventListener.AFTER, target, card)
 
 		return cards
 
@@ -707,7 +787,7 @@ class Shuffle(TargetedAction):
 		CARDS = 1
 
 	def do(self, source, target, cards):
-		logger.info("%r shuffles into %s's deck", cards, target)
+		source.log("%r shuffles into %s's deck", cards, target)
 		if not isinstance(cards, list):
 			cards = [cards]
 
@@ -747,7 +827,7 @@ class Steal(TargetedAction):
 	The controller is the controller of the source of the action.
 	"""
 	def do(self, source, target):
-		logger.info("%s takes control of %r", self, target)
+		source.log("%s takes control of %r", self, target)
 		zone = target.zone
 		target.zone = Zone.SETASIDE
 		target.controller = source.controller
@@ -759,6 +839,6 @@ class UnlockOverload(TargetedAction):
 	Unlock the target player's overload, both current and owed.
 	"""
 	def do(self, source, target):
-		logger.info("%s overload gets cleared", target)
+		source.log("%s overload gets cleared", target)
 		target.overloaded = 0
 		target.overload_locked = 0
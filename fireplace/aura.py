@@ -1,4 +1,37 @@
-from .utils import CardList, fireplace_logger as logger
+from . import journal
+from .dsl.selector import AdjacentSelector, IdSelector, OwnerSelector, Selector, SelfSelector
+from .enums import Affiliation, CardType, GameTag, Race, Zone
+from .utils import CardList
+
+
+# Selector ops whose result can only change when an entity changes zones
+# (which includes changes of controller and position)
+ZONE_OPS = (
+	Selector.MergeFilter, Selector.Merge, Selector.Unmerge,
+	Selector._and, Selector._or, Selector._not,
+	Affiliation.FRIENDLY, Affiliation.HOSTILE,
+	GameTag.BATTLECRY, GameTag.SECRET,
+)
+ZONE_OP_TYPES = (
+	CardType, Race, Zone,
+	AdjacentSelector.SelectAdjacent, IdSelector.MatchesId,
+	OwnerSelector.IsOwner, SelfSelector.IsSelf,
+)
+
+
+def depends_on_zones(selector):
+	"""
+	Returns True if the entities matched by \a selector only change when
+	an entity of the game changes zones.
+	"""
+	program = getattr(selector, "program", None)
+	if program is None:
+		return False
+	for op in program:
+		if op in ZONE_OPS or isinstance(op, ZONE_OP_TYPES):
+			continue
+		return False
+	return True
 
 
 class Aura:
@@ -6,6 +39,8 @@ class Aura:
 	A virtual Card class which is only for the source of the Enchantment buff on
 	targets affected by an aura. It is only internal.
 	"""
+	# The journal of the source's game, see BaseGame.checkpoint()
+	_journal = None
 
 	def __init__(self, action, source):
 		self.action = action
@@ -13,11 +48,29 @@ class Aura:
 		self.id = self.action._args[1]
 		self.source = source
 		self.to_be_destroyed = False
-		self._buffed = CardList()
-		self._buffs = CardList()
+		# Buffs given by the aura, by id() of their target. Cards are not
+		# hashable and may not have an entity id yet when they are buffed.
+		self._buffs = {}
+		# The game state the targets were last computed for, see state_key
+		self._state = None
+		self.incremental = depends_on_zones(self.selector)
 		# THIS IS A HACK
 		# DON'T SHOOT, IT'S TEMPORARY
 		self.on_enrage = self.id == "CS2_221e"
+		if source._journal is not None:
+			source._journal.add(self)
+
+	def __setattr__(self, name, value):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		object.__setattr__(self, name, value)
+
+	def __delattr__(self, name):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		object.__delattr__(self, name)
 
 	def __repr__(self):
 		return "<Aura (%r)>" % (self.id)
@@ -28,8 +81,20 @@ class Aura:
 			return []
 		return CardList(self.selector.eval(self.source.game, self.source))
 
+	@property
+	def state_key(self):
+		"""
+		A key for the state the aura's targets depend on, or None if the
+		targets have to be recomputed on every update.
+		"""
+		if not self.incremental:
+			return None
+		if self.on_enrage:
+			return self.source.game.zone_version, bool(self.source.enraged)
+		return self.source.game.zone_version
+
 	def summon(self):
-		logger.info("Summoning Aura %r", self)
+		self.source.log("Summoning Aura %r", self)
 		self.source.auras.append(self)
 		self.source.game.auras.append(self)
 		self.source.game.refresh_auras()
@@ -37,37 +102,50 @@ class Aura:
 	def _buff(self, target):
 		buff = self.source.buff(target, self.id)
 		buff.aura_source = self
-		self._buffs.append(buff)
-		self._buffed.append(target)
+		journal.touch(self, self._buffs)
+		self._buffs[id(target)] = buff
 
 	def _entity_buff(self, target):
 		"Returns the buff created by this aura on \a target"
-		for buff in target.buffs:
-			if buff.aura_source is self:
-				return buff
+		return self._buffs.get(id(target))
+
+	def forget(self, buff):
+		"""
+		Stop tracking \a buff, which is being destroyed.
+		Its target is buffed again on the next update if it is still valid.
+		"""
+		if self._buffs.get(id(buff.owner)) is buff:
+			journal.touch(self, self._buffs)
+			del self._buffs[id(buff.owner)]
+		self._state = None
 
 	def update(self):
 		if self.to_be_destroyed:
 			return self.destroy()
 
+		key = self.state_key
+		if key is not None and key == self._state:
+			return
+
 		targets = self.targets
+		valid = set()
 		for target in targets:
-			if not self._entity_buff(target):
+			valid.add(id(target))
+			if id(target) not in self._buffs:
 				self._buff(target)
-		# Make sure to copy the list as it can change during iteration
-		for target in self._buffed[:]:
+		# Make sure to copy the buffs as they can change during iteration
+		for key, buff in list(self._buffs.items()):
 			# Remove auras no longer valid
-			if target not in targets:
-				buff = self._entity_buff(target)
-				if buff:
-					buff.destroy()
-				self._buffed.remove(target)
+			if key not in valid:
+				buff.destroy()
+
+		# Buffing moves enchantments around, so take the key after updating
+		self._state = self.state_key
 
 	def destroy(self):
-		logger.info("Removing %r affecting %r", self, self._buffed)
+		self.source.log("Removing %r affecting %r", self, [buff.owner for buff in self._buffs.values()])
 		self.source.game.auras.remove(self)
-		for buff in self._buffs[:]:
+		for buff in list(self._buffs.values()):
 			buff.destroy()
 		del self._buffs
-		del self._buffed
 		self.source.auras.remove(self)
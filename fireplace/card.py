@@ -1,12 +1,13 @@
+import logging
 from itertools import chain
 from . import cards as CardDB, rules
-from .actions import Damage, Deaths, Destroy, Heal, Morph, Play, Shuffle, SetCurrentHealth
+from .actions import Damage, Deaths, Destroy, Heal, Morph, Play, Shuffle, SetCurrentHealth, resolve
 from .aura import Aura
 from .entity import Entity, boolean_property, int_property
 from .enums import CardType, PlayReq, Race, Rarity, Zone
 from .managers import CardManager
-from .targeting import is_valid_target
-from .utils import CardList
+from .targeting import TARGETING_PREREQUISITES, is_valid_target
+from .utils import CardList, IndexedCardList
 
 
 THE_COIN = "GAME_005"
@@ -34,20 +35,20 @@ class BaseCard(Entity):
 	atk = int_property("atk")
 	max_health = int_property("max_health")
 	cost = int_property("cost")
+	# Defaults shared by all cards, until set on the card itself
+	aura = False
+	heropower_damage = 0
+	silenced = False
+	spellpower = 0
+	turns_in_play = 0
+	_zone = Zone.INVALID
 
 	def __init__(self, id, data):
 		self.data = data
 		super().__init__()
-		self.auras = []
-		self.requirements = data.requirements.copy()
+		self.auras = IndexedCardList()
 		self.id = id
 		self.controller = None
-		self.aura = False
-		self.heropower_damage = 0
-		self.silenced = False
-		self.spellpower = 0
-		self.turns_in_play = 0
-		self._zone = Zone.INVALID
 		self.tags.update(data.tags)
 
 	def __str__(self):
@@ -56,6 +57,15 @@ class BaseCard(Entity):
 	def __repr__(self):
 		return "<%s (%r)>" % (self.__class__.__name__, self.__str__())
 
+	@property
+	def requirements(self):
+		# Shared with the card data, assign a new dict to change it
+		return self.__dict__.get("_requirements", self.data.requirements)
+
+	@requirements.setter
+	def requirements(self, value):
+		self._requirements = value
+
 	def __eq__(self, other):
 		if isinstance(other, BaseCard):
 			return self.id.__eq__(other.id)
@@ -73,12 +83,30 @@ class BaseCard(Entity):
 
 	@zone.setter
 	def zone(self, value):
-		self._set_zone(value)
+		game = self.game
+		old = self._zone
+		game.zone_moves += 1
+		try:
+			self._set_zone(value)
+		finally:
+			game.zone_moves -= 1
+			game.zone_version += 1
+			# Secrets end up in the SECRET zone when moved to PLAY
+			zones = (old, self._zone)
+			game.zones_changed(zones)
+			self.zone_controller.zones_changed(zones)
+
+	@property
+	def zone_controller(self):
+		"""
+		The player whose zone properties list the card, see zone_property.
+		"""
+		return self.controller
 
 	def _set_zone(self, value):
 		old = self.zone
 		if old:
-			self.logger.debug("%r moves from %r to %r", self, old, value)
+			self.log("%r moves from %r to %r", self, old, value, level=logging.DEBUG)
 		assert old != value
 		caches = {
 			Zone.HAND: self.controller.hand,
@@ -90,6 +118,13 @@ class BaseCard(Entity):
 		if caches.get(value) is not None:
 			caches[value].append(self)
 		self._zone = value
+		if self._changes is not None and Zone.HAND in (old, value):
+			# The positions of the other cards in hand shift
+			for card in self.controller.hand:
+				card.notify_change()
+		self.game.refresh_listeners(self)
+		if value == Zone.REMOVEDFROMGAME:
+			self.game.manager.remove_entity(self)
 
 		if value == Zone.PLAY:
 			if hasattr(self.data.scripts, "aura"):
@@ -121,18 +156,26 @@ class BaseCard(Entity):
 
 class PlayableCard(BaseCard):
 	windfury = boolean_property("windfury")
+	cant_play = False
+	has_battlecry = False
+	has_combo = False
+	overload = 0
+	target = None
+	rarity = Rarity.INVALID
 
 	def __init__(self, id, data):
-		self.buffs = CardList()
-		self.cant_play = False
-		self.entourage = CardList(data.entourage)
-		self.has_battlecry = False
-		self.has_combo = False
-		self.overload = 0
-		self.target = None
-		self.rarity = Rarity.INVALID
+		self.buffs = IndexedCardList()
 		super().__init__(id, data)
 
+	@property
+	def entourage(self):
+		# Shared with the card data, assign a new list to change it
+		return self.__dict__.get("_entourage", self.data.entourage)
+
+	@entourage.setter
+	def entourage(self, value):
+		self._entourage = value
+
 	@property
 	def events(self):
 		if self.zone == Zone.HAND:
@@ -182,6 +225,9 @@ class PlayableCard(BaseCard):
 			self.clear_buffs()
 
 	def action(self):
+		resolve(self._action())
+
+	def _action(self):
 		if self.cant_play:
 			self.log("%r play action cannot continue", self)
 			return
@@ -205,14 +251,22 @@ class PlayableCard(BaseCard):
 		else:
 			actions = []
 
-		if callable(actions):
-			actions = actions(self, **kwargs)
+		manager = self.game.manager
+		tracing = manager.tracers
+		if tracing:
+			manager.trace("script:play", self.id, self)
+		try:
+			if callable(actions):
+				actions = actions(self, **kwargs)
 
-		if actions:
-			self.game.queue_actions(self, actions)
-			# Hard-process deaths after a battlecry.
-			# cf. test_knife_juggler()
-			self.game.process_deaths()
+			if actions:
+				yield self.game._queue_actions(self, actions)
+				# Hard-process deaths after a battlecry.
+				# cf. test_knife_juggler()
+				yield self.game._process_deaths()
+		finally:
+			if tracing:
+				manager.trace_end("script:play", self.id, self)
 
 		if self.overload:
 			self.log("%r overloads %s for %i", self, self.controller, self.overload)
@@ -256,9 +310,16 @@ class PlayableCard(BaseCard):
 		return self.game.queue_actions(self, [Heal(target, amount)])
 
 	def hit(self, target, amount):
-		return self.game.queue_actions(self, [Damage(target, amount)])
+		return resolve(self._hit_target(target, amount))
 
-	def is_playable(self):
+	def _hit_target(self, target, amount):
+		return self.game._queue_actions(self, [Damage(target, amount)])
+
+	def is_playable(self, targets=None):
+		"""
+		Returns whether the card can be played.
+		\a targets: The result of play_targets(), if already computed
+		"""
 		if self.controller.choice:
 			return False
 		if not self.controller.current_player:
@@ -266,7 +327,7 @@ class PlayableCard(BaseCard):
 		if self.controller.mana < self.cost:
 			return False
 		if PlayReq.REQ_TARGET_TO_PLAY in self.requirements:
-			if not self.targets:
+			if not (self.targets if targets is None else targets):
 				return False
 		if PlayReq.REQ_NUM_MINION_SLOTS in self.requirements:
 			if self.requirements[PlayReq.REQ_NUM_MINION_SLOTS] > self.controller.minion_slots:
@@ -308,17 +369,32 @@ class PlayableCard(BaseCard):
 		"""
 		return self.game.queue_actions(self.controller, [Shuffle(self.controller, self)])
 
-	def has_target(self):
+	def has_target(self, targets=None):
+		"""
+		Returns whether the card is played on a target.
+		\a targets: The result of play_targets(), if already computed
+		"""
 		if self.has_combo and PlayReq.REQ_TARGET_FOR_COMBO in self.requirements:
 			if self.controller.combo:
 				return True
 		if PlayReq.REQ_TARGET_IF_AVAILABLE in self.requirements:
-			return bool(self.targets)
+			return bool(self.targets if targets is None else targets)
 		if PlayReq.REQ_TARGET_IF_AVAILABLE_AND_DRAGON_IN_HAND in self.requirements:
 			if self.controller.hand.filter(race=Race.DRAGON):
-				return bool(self.targets)
+				return bool(self.targets if targets is None else targets)
 		return PlayReq.REQ_TARGET_TO_PLAY in self.requirements
 
+	def play_targets(self):
+		"""
+		Returns the targets the card can be played on, or an empty list
+		if it never takes one.
+		"""
+		requirements = self.requirements
+		for req in TARGETING_PREREQUISITES:
+			if req in requirements:
+				return self.targets
+		return []
+
 	@property
 	def targets(self):
 		return [card for card in self.game.characters if is_valid_target(self, card)]
@@ -348,16 +424,13 @@ class Character(LiveEntity):
 	cant_be_targeted_by_opponents = boolean_property("cant_be_targeted_by_opponents")
 	immune = boolean_property("immune")
 	min_health = boolean_property("min_health")
-
-	def __init__(self, *args):
-		self.attacking = False
-		self.frozen = False
-		self.cant_attack = False
-		self.cant_be_targeted_by_abilities = False
-		self.cant_be_targeted_by_hero_powers = False
-		self.num_attacks = 0
-		self.race = Race.INVALID
-		super().__init__(*args)
+	attacking = False
+	frozen = boolean_property("frozen")
+	cant_attack = False
+	cant_be_targeted_by_abilities = False
+	cant_be_targeted_by_hero_powers = False
+	num_attacks = 0
+	race = Race.INVALID
 
 	@property
 	def attackable(self):
@@ -377,7 +450,13 @@ class Character(LiveEntity):
 			ret.append(self.controller.opponent.hero)
 		return ret
 
-	def can_attack(self, target=None):
+	def can_attack(self, target=None, targets=None):
+		"""
+		Returns whether the character can attack, \a target if given.
+		\a targets: The character's targets, if already computed
+		"""
+		if targets is None:
+			targets = self.targets
 		if not self.zone == Zone.PLAY:
 			return False
 		if self.cant_attack:
@@ -390,9 +469,9 @@ class Character(LiveEntity):
 			return False
 		if self.frozen:
 			return False
-		if not self.targets:
+		if not targets:
 			return False
-		if target is not None and target not in self.targets:
+		if target is not None and target not in targets:
 			return False
 
 		return True
@@ -461,10 +540,10 @@ class Character(LiveEntity):
 
 
 class Hero(Character):
-	def __init__(self, id, data):
-		self.armor = 0
-		self.power = None
-		super().__init__(id, data)
+	# The equipped weapon is a slot only while it is not exhausted
+	cache_stats = False
+	armor = 0
+	power = None
 
 	@property
 	def slots(self):
@@ -510,13 +589,11 @@ class Minion(Character):
 		"taunt", "windfury",
 	)
 
-	def __init__(self, id, data):
-		self._enrage = None
-		self.always_wins_brawls = False
-		self.divine_shield = False
-		self.enrage = False
-		self.poisonous = False
-		super().__init__(id, data)
+	_enrage = None
+	_has_enrage = False
+	always_wins_brawls = False
+	divine_shield = False
+	_poisonous = False
 
 	@property
 	def events(self):
@@ -563,10 +640,37 @@ class Minion(Character):
 			slots.append(self._enrage)
 		return slots
 
+	@property
+	def enrage(self):
+		return self._has_enrage
+
+	@enrage.setter
+	def enrage(self, value):
+		self._has_enrage = value
+		self.invalidate_stats()
+
 	@property
 	def enraged(self):
 		return self.enrage and self.damage
 
+	@Character.damage.setter
+	def damage(self, amount):
+		enraged = self.enraged
+		Character.damage.fset(self, amount)
+		if self.enraged != enraged:
+			self.invalidate_stats()
+
+	@property
+	def poisonous(self):
+		return self._poisonous
+
+	@poisonous.setter
+	def poisonous(self, value):
+		self._poisonous = value
+		if self.zone == Zone.PLAY:
+			# Poisonous minions have an extra Damage listener
+			self.game.refresh_listeners(self)
+
 	def _set_zone(self, value):
 		if value == Zone.PLAY:
 			self.controller.field.append(self)
@@ -577,6 +681,10 @@ class Minion(Character):
 			if self.damage:
 				self.damage = 0
 
+		if self._changes is not None and Zone.PLAY in (self.zone, value):
+			for minion in self.controller.field:
+				minion.notify_change()
+
 		super()._set_zone(value)
 
 	def bounce(self):
@@ -587,8 +695,8 @@ class Minion(Character):
 		else:
 			self.zone = Zone.HAND
 
-	def hit(self, target, amount):
-		super().hit(target, amount)
+	def _hit_target(self, target, amount):
+		yield super()._hit_target(target, amount)
 		if self.stealthed:
 			self.stealthed = False
 
@@ -603,8 +711,8 @@ class Minion(Character):
 	def morph(self, into):
 		return self.game.queue_actions(self, [Morph(self, into)])
 
-	def is_playable(self):
-		playable = super().is_playable()
+	def is_playable(self, targets=None):
+		playable = super().is_playable(targets)
 		if len(self.controller.field) >= self.game.MAX_MINIONS_ON_FIELD:
 			return False
 		return playable
@@ -620,22 +728,22 @@ class Minion(Character):
 				setattr(self, attr, False)
 
 		# Wipe the event listeners
-		self._events = []
+		self._events = IndexedCardList()
+		self.game.refresh_listeners(self)
 		self.silenced = True
+		self.invalidate_stats()
 
 
 class Spell(PlayableCard):
-	def __init__(self, *args):
-		self.immune_to_spellpower = False
-		self.receives_double_spelldamage_bonus = False
-		super().__init__(*args)
+	immune_to_spellpower = False
+	receives_double_spelldamage_bonus = False
 
-	def hit(self, target, amount):
+	def _hit_target(self, target, amount):
 		if not self.immune_to_spellpower:
 			amount = self.controller.get_spell_damage(amount)
 		if self.receives_double_spelldamage_bonus:
 			amount *= 2
-		super().hit(target, amount)
+		return super()._hit_target(target, amount)
 
 
 class Secret(Spell):
@@ -653,11 +761,11 @@ class Secret(Spell):
 			self.controller.secrets.append(self)
 		super()._set_zone(value)
 
-	def is_playable(self):
+	def is_playable(self, targets=None):
 		# secrets are all unique
 		if self.controller.secrets.contains(self):
 			return False
-		return super().is_playable()
+		return super().is_playable(targets)
 
 	def reveal(self):
 		return self.game.queue_actions(self, [Reveal(self)])
@@ -665,12 +773,9 @@ class Secret(Spell):
 
 class Enchantment(BaseCard):
 	slots = []
-
-	def __init__(self, *args):
-		self.aura_source = None
-		self.one_turn_effect = False
-		self.attack_health_swap = False
-		super().__init__(*args)
+	aura_source = None
+	one_turn_effect = False
+	attack_health_swap = False
 
 	def _getattr(self, attr, i):
 		if self.attack_health_swap:
@@ -680,13 +785,27 @@ class Enchantment(BaseCard):
 				return self._swapped_health
 		return super()._getattr(attr, i)
 
+	@property
+	def zone_controller(self):
+		# Listed with the entities of its owner, whichever card buffed it
+		owner = getattr(self, "owner", None)
+		return getattr(owner, "controller", None) or self.controller
+
 	def _set_zone(self, zone):
 		if zone == Zone.PLAY:
 			self.owner.buffs.append(self)
+			self.owner.invalidate_stats()
 		elif zone == Zone.REMOVEDFROMGAME:
 			self.owner.buffs.remove(self)
+			self.owner.invalidate_stats()
 		super()._set_zone(zone)
 
+	def invalidate_stats(self):
+		super().invalidate_stats()
+		owner = getattr(self, "owner", None)
+		if owner is not None and self.zone == Zone.PLAY:
+			owner.invalidate_stats()
+
 	def apply(self, target):
 		self.log("Applying %r to %r", self, target)
 		self.owner = target
@@ -707,7 +826,7 @@ class Enchantment(BaseCard):
 		self.zone = Zone.REMOVEDFROMGAME
 		if self.aura_source:
 			# Clean up the buff from its source auras
-			self.aura_source._buffs.remove(self)
+			self.aura_source.forget(self)
 	_destroy = destroy
 
 
@@ -723,6 +842,9 @@ class Enrage(object):
 	def _getattr(self, attr, i):
 		return i + getattr(self, attr, 0)
 
+	def _stat_is_static(self, attr):
+		return True
+
 
 class Weapon(rules.WeaponRules, LiveEntity):
 	health_attribute = "durability"
@@ -773,30 +895,45 @@ class HeroPower(PlayableCard):
 		super()._set_zone(value)
 
 	def activate(self):
-		actions = self.data.scripts.activate
-		if callable(actions):
-			kwargs = {}
-			if self.target:
-				kwargs["target"] = self.target
-			actions = actions(self, **kwargs)
-
+		manager = self.game.manager
+		tracing = manager.tracers
+		if tracing:
+			manager.trace("script:activate", self.id, self)
 		ret = []
-		if actions:
-			ret += self.game.queue_actions(self, actions)
+		try:
+			actions = self.data.scripts.activate
+			if callable(actions):
+				kwargs = {}
+				if self.target:
+					kwargs["target"] = self.target
+				actions = actions(self, **kwargs)
+
+			if actions:
+				ret += self.game.queue_actions(self, actions)
+		finally:
+			if tracing:
+				manager.trace_end("script:activate", self.id, self)
 
 		for minion in self.controller.field.filter(has_inspire=True):
 			if not hasattr(minion.data.scripts, "inspire"):
 				raise NotImplementedError("Missing inspire script for %r" % (minion))
 			actions = minion.data.scripts.inspire
 			if actions:
-				ret += self.game.queue_actions(self, actions)
+				tracing = manager.tracers
+				if tracing:
+					manager.trace("script:inspire", minion.id, minion)
+				try:
+					ret += self.game.queue_actions(self, actions)
+				finally:
+					if tracing:
+						manager.trace_end("script:inspire", minion.id, minion)
 
 		return ret
 
-	def hit(self, target, amount):
+	def _hit_target(self, target, amount):
 		amount += self.controller.heropower_damage
 		amount *= (self.controller.hero_power_double + 1)
-		super().hit(target, amount)
+		return super()._hit_target(target, amount)
 
 	def is_playable(self):
 		return False
@@ -818,10 +955,12 @@ class HeroPower(PlayableCard):
 		self.controller.times_hero_power_used_this_game += 1
 		self.controller.used_mana += self.cost
 		self.target = None
+		# Exhausted outside of any action
+		self.notify_change()
 
 		return ret
 
-	def is_usable(self):
+	def is_usable(self, targets=None):
 		if self.exhausted:
 			return False
-		return super().is_playable()
+		return super().is_playable(targets)
@@ -1,69 +1,197 @@
+import importlib
 import os
-from pkg_resources import resource_filename
-from .blackrock import *
-from .game import *
-from .classic import *
-from .debug import *
-from .gvg import *
-from .naxxramas import *
-from .tgt import *
-from .tutorial import *
+import re
+import sys
 from .. import cardxml
 
 
+# Directory of the package, card set modules and card data
+PATH = os.path.dirname(__file__)
+
+
+# Card set packages, imported on demand. When several of them define the
+# same card, the last one wins.
+CARD_SETS = (
+	"blackrock", "game", "classic", "debug", "gvg", "naxxramas", "tgt", "tutorial",
+)
+
+# Maps card IDs to the module defining them, see _index_definitions()
+_definitions = None
+
+# Card set modules checked against the index, see _import_definitions()
+_verified = set()
+
+
+def _set_modules(package):
+	"""
+	Returns the modules star-imported by \a package, recursively and in
+	import order, without importing them.
+	"""
+	path = os.path.join(PATH, *package.split("."))
+	with open(os.path.join(path, "__init__.py"), "r") as f:
+		names = re.findall(r"^from \.(\w+) import \*", f.read(), re.MULTILINE)
+	ret = []
+	for name in names:
+		module = "%s.%s" % (package, name)
+		if os.path.isdir(os.path.join(path, name)):
+			ret += _set_modules(module)
+		else:
+			ret.append(module)
+	return ret
+
+
+def _index_definitions():
+	"""
+	Find the module defining every card, by scanning the sources of the card
+	sets for top-level classes. The result is checked against each module
+	once it is imported.
+	"""
+	ret = {}
+	for package in CARD_SETS:
+		for module in _set_modules(package):
+			with open(os.path.join(PATH, *module.split(".")) + ".py", "r") as f:
+				for id in re.findall(r"^class (\w+)", f.read(), re.MULTILINE):
+					ret[id] = module
+	return ret
+
+
+def _import_definitions(module):
+	"""
+	Import the card set \a module, and check that it defines the cards
+	indexed to it and that every card it defines is indexed.
+	"""
+	ret = importlib.import_module("." + module, __name__)
+	if module not in _verified:
+		defined = {
+			id for id, obj in vars(ret).items()
+			if id in db and getattr(obj, "__module__", None) == ret.__name__
+		}
+		indexed = {id for id, name in _definitions.items() if name == module and id in db}
+		# Cards defined again by a later module are indexed to that one
+		missing = (indexed - defined) | {id for id in defined if id not in _definitions}
+		if missing:
+			raise RuntimeError("The card index does not match %r for %s" % (
+				module, ", ".join(sorted(missing))
+			))
+		_verified.add(module)
+	return ret
+
+
+def _definition(id):
+	"""
+	Returns the Python definition of \a id, importing its card set as needed.
+	"""
+	global _definitions
+	if _definitions is None:
+		_definitions = _index_definitions()
+	module = _definitions.get(id)
+	if module is None:
+		return None
+	return getattr(_import_definitions(module), id)
+
+
 def merge(id):
 	"""
 	Find the xmlcard and the card definition of \a id
 	Then return a merged class of the two
 	"""
 	card = db[id]
-	carddef = globals().get(id)
+	if hasattr(card, "scripts"):
+		# This basically means the card has already been merged...
+		return card
+	carddef = _definition(id)
 	if not carddef:
 		cls = type(id, (), {})
 	else:
-		if hasattr(carddef, "scripts"):
-			# This basically means the card has already been merged...
-			return card
 		cls = type(id, (carddef, ), {})
 	card.scripts = cls
+	globals()[id] = card
 	return card
 
 
+def __getattr__(id):
+	# Cards are merged on first access
+	if "db" in globals() and id in db:
+		return merge(id)
+	raise AttributeError("module %r has no attribute %r" % (__name__, id))
+
+
+# Card attributes indexed by filter(), other filters scan the candidates
+INDEXED_ATTRIBUTES = (
+	"card_class", "card_set", "collectible", "cost", "race", "rarity", "spare_part", "type",
+)
+
+# Maps indexed attributes to {value: set of card IDs}, see _attribute_index()
+_indexes = {}
+
+# Results of filter(), keyed by their filters
+_filter_cache = {}
+
+
+def _attribute_index(attr):
+	"""
+	Returns the index of the database on \a attr, building it as needed.
+	"""
+	index = _indexes.get(attr)
+	if index is None:
+		index = _indexes[attr] = {}
+		for id, card in db.items():
+			index.setdefault(getattr(card, attr), set()).add(id)
+	return index
+
+
+def _filter(filters):
+	ids = None
+	scanned = []
+	for attr, value in filters:
+		if attr in INDEXED_ATTRIBUTES:
+			matches = _attribute_index(attr).get(value, set())
+			ids = matches if ids is None else ids & matches
+		else:
+			scanned.append((attr, value))
+
+	# Keep the database order, random picks depend on it
+	if ids is None:
+		ret = cardlist
+	else:
+		ret = [id for id in cardlist if id in ids]
+	for attr, value in scanned:
+		ret = [id for id in ret if getattr(db[id], attr) == value]
+	return tuple(ret)
+
+
 def filter(**kwargs):
 	"""
-	Returns a list of card IDs matching the given filters. Each filter, if not
+	Returns a tuple of card IDs matching the given filters. Each filter, if not
 	None, is matched against the registered card database.
 	cards.
+	The same tuple is returned for the same filters.
 	\a collectible: Whether the card is collectible or not.
 	\a type: The type of the card (fireplace.enums.CardType)
 	\a race: The race (tribe) of the card (fireplace.enums.Race)
 	\a rarity: The rarity of the card (fireplace.enums.Rarity)
 	\a cost: The mana cost of the card
 	"""
-	cards = db.values()
-
-	for attr, value in kwargs.items():
-		if value is not None:
-			# What? this doesn't work?
-			# cards = __builtins__["filter"](lambda c: getattr(c, attr) == value, cards)
-			cards = [card for card in cards if getattr(card, attr) == value]
+	filters = tuple(sorted((k, v) for k, v in kwargs.items() if v is not None))
+	ret = _filter_cache.get(filters)
+	if ret is None:
+		ret = _filter_cache[filters] = _filter(filters)
+	return ret
 
-	return [card.id for card in cards]
 
-
-# Here we import every card from every set and load the cardxml database.
-# For every card, we will "merge" the class with its Python definition if
-# it exists.
+# Here we load the cardxml database. Every card is "merged" with its
+# Python definition, if it exists, on first access (see merge()).
 # This code is only ran once, at initial import.
 
 if "cardlist" not in globals():
-	xmlfile = resource_filename(__name__, "data/CardDefs.xml")
+	xmlfile = os.path.join(PATH, "data", "CardDefs.xml")
 	if not os.path.exists(xmlfile):
 		raise RuntimeError("%r does not exist - generate it!" % (xmlfile))
 
-	with open(xmlfile, "r") as f:
-		db, xml = cardxml.load(xmlfile)
-		cardlist = []
-		for id in db:
-			globals()[id] = merge(id)
-			cardlist.append(id)
+	db = cardxml.load_cached(xmlfile)
+	cardlist = list(db)
+
+	if sys.version_info < (3, 7):
+		# Module __getattr__ (PEP 562) is not supported, merge every card now
+		for id in cardlist:
+			merge(id)
@@ -35,7 +35,7 @@ class EX1_062:
 # Tinkmaster Overspark
 class EX1_083:
 	def play(self):
-		choice = random.choice(("EX1_tk28", "EX1_tk29"))
+		choice = self.game.random.choice(("EX1_tk28", "EX1_tk29"))
 		return Morph(RANDOM_MINION, choice)
 
 
@@ -90,7 +90,7 @@ class EX1_298:
 # Nat Pagle
 class EX1_557:
 	events = OWN_TURN_BEGIN.on(
-		lambda self, player: random.randint(0, 1) and Draw(CONTROLLER)
+		lambda self, player: self.game.random.randint(0, 1) and Draw(CONTROLLER)
 	)
 
 
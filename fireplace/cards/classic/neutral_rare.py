@@ -147,4 +147,4 @@ class NEW1_041:
 	def play(self):
 		targets = [t for t in self.controller.opponent.field if t.atk <= 2]
 		if targets:
-			return Destroy(random.choice(targets))
+			return Destroy(self.game.random.choice(targets))
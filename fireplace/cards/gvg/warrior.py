@@ -39,7 +39,7 @@ class GVG_050:
 			targets = [t for t in targets if t.health > t.min_health]
 			if not targets:
 				break
-			yield Hit(random.choice(targets), 1)
+			yield Hit(self.game.random.choice(targets), 1)
 
 
 # Crush
@@ -1,10 +1,18 @@
+import hashlib
+import os
+import pickle
 from xml.etree import ElementTree
 from .enums import *
 
 
+# Bump when the attributes of CardXML change, to invalidate the caches
+CACHE_VERSION = 1
+
+
 class CardXML(object):
 	def __init__(self, xml):
 		self.xml = xml
+		self.id = xml.attrib["CardID"]
 		e = self.xml.findall("./Tag")
 		self.tags = {
 			GameTag(int(tag.attrib["enumID"])): self._get_tag(tag) for tag in e
@@ -33,6 +41,13 @@ class CardXML(object):
 	def __repr__(self):
 		return "<%s: %r>" % (self.id, self.name)
 
+	def __getstate__(self):
+		# The xml element is only needed to build the card, or to edit it
+		# when generating CardDefs.xml. Cached cards do without.
+		state = self.__dict__.copy()
+		state["xml"] = None
+		return state
+
 	def _find_tag(self, id):
 		return self.xml.find('./Tag[@enumID="%i"]' % (id))
 
@@ -59,10 +74,6 @@ class CardXML(object):
 			PlayReq(int(t.attrib["reqID"])): int(t.attrib["param"] or 0) for t in reqs
 		}
 
-	@property
-	def id(self):
-		return self.xml.attrib["CardID"]
-
 	@property
 	def name(self):
 		return self.tags[GameTag.CARDNAME]
@@ -120,3 +131,41 @@ def load(path):
 			card = CardXML(carddata)
 			db[card.id] = card
 	return db, xml
+
+
+def _cache_key(path):
+	with open(path, "rb") as f:
+		digest = hashlib.sha1(f.read()).hexdigest()
+	return (CACHE_VERSION, os.stat(path).st_mtime_ns, digest)
+
+
+def load_cached(path, cache_path=None):
+	"""
+	Load the card database of \a path like load(), through a pickled copy
+	stored in \a cache_path (next to \a path by default). The cache is
+	keyed by the hash and modification time of \a path and rebuilt when
+	stale. Only the database is returned, and its cards have no xml.
+	"""
+	if cache_path is None:
+		cache_path = path + ".cache"
+	key = _cache_key(path)
+
+	try:
+		with open(cache_path, "rb") as f:
+			if pickle.load(f) == key:
+				return pickle.load(f)
+	except Exception:
+		# Missing, stale or corrupt cache, build it again
+		pass
+
+	db, xml = load(path)
+	try:
+		tmp_path = "%s.%i.tmp" % (cache_path, os.getpid())
+		with open(tmp_path, "wb") as f:
+			pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+			pickle.dump(db, f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmp_path, cache_path)
+	except OSError:
+		# The data directory is not writable, go without a cache
+		pass
+	return db
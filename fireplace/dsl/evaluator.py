@@ -1,5 +1,4 @@
 import copy
-from ..utils import fireplace_logger as logger
 
 
 class Evaluator:
@@ -35,8 +34,12 @@ class Evaluator:
 		return []
 
 	def trigger(self, source):
+		from ..actions import resolve
+		resolve(self._trigger(source))
+
+	def _trigger(self, source):
 		for action in self.get_actions(source):
-			action.trigger(source)
+			yield action._trigger(source)
 
 
 class Dead(Evaluator):
@@ -81,5 +84,5 @@ class Joust(Evaluator):
 		t1 = self.selector1.eval(source.game, source)
 		t2 = self.selector2.eval(source.game, source)
 		diff = sum(t.cost for t in t1) - sum(t.cost for t in t2)
-		logger.info("Jousting %r vs %r -> %i difference", t1, t2, diff)
+		source.log("Jousting %r vs %r -> %i difference", t1, t2, diff)
 		return diff > 0
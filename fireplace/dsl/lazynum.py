@@ -1,5 +1,4 @@
 import operator
-import random
 from .evaluator import Evaluator
 from .selector import Selector
 
@@ -88,4 +87,4 @@ class RandomNumber(LazyNum):
 		return "%s(%r)" % (self.__class__.__name__, self.choices)
 
 	def evaluate(self, source):
-		return random.choice(self.choices)
+		return source.game.random.choice(self.choices)
@@ -1,5 +1,3 @@
-import random
-from ..utils import fireplace_logger as logger
 from .lazynum import LazyNum
 
 
@@ -48,7 +46,7 @@ class RandomCardPicker(Picker):
 			cards = self.get_cards(source)
 		else:
 			cards = self.cards
-		return [random.choice(cards)]
+		return [source.game.random.choice(cards)]
 
 
 class Copy(Picker):
@@ -65,7 +63,7 @@ class Copy(Picker):
 		"""
 		Return a copy of \a entity
 		"""
-		logger.info("Creating a copy of %r", entity)
+		source.log("Creating a copy of %r", entity)
 		return source.controller.card(entity.id, source)
 
 	def pick(self, source) -> [str]:
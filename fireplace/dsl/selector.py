@@ -1,5 +1,4 @@
 import operator
-import random
 from enum import IntEnum
 from ..enums import Affiliation, CardType, GameTag, Race, Zone
 from ..utils import CardList
@@ -29,6 +28,11 @@ class Selector:
 	class Unmerge:
 		pass
 
+	# Cached result of compile(), built on the first eval()
+	_compiled = None
+	# Cached repr(), naming the selector for tracers
+	_trace_name = None
+
 	def __init__(self, tag=None):
 		self.program = []
 		if tag is not None:
@@ -66,6 +70,112 @@ class Selector:
 		return result
 
 	def eval(self, entities, source):
+		if not entities:
+			return []
+		if self._compiled is None:
+			self._compiled = self.compile() or self.interpret
+		manager = source.game.manager
+		if manager.tracers:
+			name = self._trace_name
+			if name is None:
+				name = self._trace_name = repr(self)
+			manager.trace("selector", name, source)
+			try:
+				return self._compiled(entities, source)
+			finally:
+				manager.trace_end("selector", name, source)
+		return self._compiled(entities, source)
+
+	def compile(self):
+		"""
+		Compile the program into a function of (entities, source) equivalent
+		to interpret(). The program is only walked once: every test block is
+		turned into a short-circuiting predicate made of the ops' test methods.
+		Returns None if the program contains custom callables which can only
+		run on the interpreter stack.
+		"""
+		program = self.program
+		steps = []
+		opc = 0
+		try:
+			while opc < len(program):
+				if program[opc] is not Selector.MergeFilter:
+					test, opc = self._compile_test(opc)
+					steps.append((test, None, None))
+					if opc >= len(program):
+						break
+				else:
+					opc += 1
+				# merge step
+				test, opc = self._compile_test(opc)
+				merges = []
+				while opc < len(program):
+					op = program[opc]
+					opc += 1
+					if op is Selector.Unmerge:
+						break
+					merges.append(op)
+				ops = []
+				while opc < len(program) and program[opc] in _BOOLEAN_OPS:
+					ops.append(program[opc])
+					opc += 1
+				steps.append((test, merges, ops))
+		except _NotCompilable:
+			return None
+
+		def func(entities, source):
+			result = []
+			for test, merges, ops in steps:
+				if merges is None:
+					result += [e for e in entities if test(e, source)]
+					continue
+				merge_input = CardList([e for e in entities if test(e, source)])
+				merge_output = CardList()
+				for op in merges:
+					merge_output += op.merge(self, merge_input)
+				negated = False
+				combined = False
+				for op in ops:
+					# special handling for operators on merged collections:
+					if op is Selector._or:
+						result += [e for e in merge_output]
+						combined = True
+					elif op is Selector._and:
+						result = [e for e in result if (e in merge_output) != negated]
+						combined = True
+					else:
+						negated = not negated
+				if not combined:
+					# assume or
+					result += merge_output
+			return result
+
+		return func
+
+	def _compile_test(self, pc):
+		"""
+		Compile the ops from \a pc up to the next merge op into a predicate.
+		Returns the predicate and the program counter past the block.
+		"""
+		stack = []
+		while pc < len(self.program):
+			op = self.program[pc]
+			pc += 1
+			if op is Selector.Merge or op is Selector.MergeFilter:
+				break
+			if op is Selector._and or op is Selector._or:
+				a = stack.pop()
+				b = stack.pop()
+				stack.append(_combine(op, b, a))
+			elif op is Selector._not:
+				stack.append(_negate(stack.pop()))
+			elif callable(op):
+				raise _NotCompilable(op)
+			else:
+				stack.append(op.test)
+		return stack[-1], pc
+
+	def interpret(self, entities, source):
 		if not entities:
 			return []
 		self.opc = 0  # outer program counter
@@ -139,6 +249,48 @@ class Selector:
 		stack.append(not stack.pop())
 
 
+_BOOLEAN_OPS = (Selector._and, Selector._or, Selector._not)
+
+
+class _NotCompilable(Exception):
+	pass
+
+
+def _combine(op, a, b):
+	"""
+	Returns a predicate for the boolean \a op of predicates \a a and \a b.
+	Chains of the same operator are flattened into a single predicate.
+	"""
+	tests = []
+	for test in (a, b):
+		if getattr(test, "combines", None) is op:
+			tests += test.tests
+		else:
+			tests.append(test)
+
+	if op is Selector._and:
+		def func(entity, source):
+			for test in tests:
+				if not test(entity, source):
+					return False
+			return True
+	else:
+		def func(entity, source):
+			for test in tests:
+				if test(entity, source):
+					return True
+			return False
+	func.combines = op
+	func.tests = tests
+	return func
+
+
+def _negate(test):
+	def func(entity, source):
+		return not test(entity, source)
+	return func
+
+
 class AttrSelector(Selector):
 	"""
 	Selects entities with tags matching a comparison.
@@ -277,7 +429,9 @@ class RandomSelector(Selector):
 			self.times = times
 
 		def merge(self, selector, entities):
-			return random.sample(entities, min(len(entities), self.times))
+			if not entities:
+				return []
+			return entities[0].game.random.sample(entities, min(len(entities), self.times))
 
 	def __init__(self, selector):
 		self.random = self.SelectRandom(1)
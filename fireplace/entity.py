@@ -1,26 +1,79 @@
+import logging
 import uuid
-from .utils import fireplace_logger
+from itertools import count
+from .utils import IndexedCardList, fireplace_logger
+
+
+_uuid_counter = count(1)
 
 
 class Entity(object):
 	base_events = []
 	logger = fireplace_logger
+	# Whether int and boolean properties may be cached between buff changes
+	cache_stats = True
+	# Number UUIDs from a process-wide counter rather than with uuid4().
+	# Cheaper and reproducible, but only unique within the process.
+	sequential_uuids = False
+	_uuid = None
+	# Replaced, never updated in place (see BaseGame.refresh_listeners())
+	_listener_keys = frozenset()
+	# The changed entities of a game tracking changes, see BaseGame.track_changes()
+	_changes = None
+	# The journal of the entity's game, see BaseGame.checkpoint()
+	_journal = None
 
 	def __init__(self):
 		self.manager = self.Manager(self)
-		self.tags = self.manager
-		self.uuid = uuid.uuid4()
+		self._stat_cache = {}
+		self._zone_caches = {}
 
 		scripts = getattr(self.data, "scripts", None)
 		events = getattr(scripts, "events", [])
 		if not isinstance(events, list):
-			self._events = [events]
+			self._events = IndexedCardList([events])
 		else:
-			self._events = events[:]
+			self._events = IndexedCardList(events)
+
+	def __setattr__(self, name, value):
+		# Record the write in the journal and the changes of the game
+		journal = self._journal
+		if journal is not None:
+			if journal.levels:
+				journal.touch(self)
+			if isinstance(value, IndexedCardList):
+				journal.add(value)
+		object.__setattr__(self, name, value)
+		changes = self._changes
+		if changes is not None:
+			changes[id(self)] = self
+
+	def __delattr__(self, name):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		object.__delattr__(self, name)
+		changes = self._changes
+		if changes is not None:
+			changes[id(self)] = self
 
 	def __int__(self):
 		return self.entity_id
 
+	@property
+	def tags(self):
+		return self.manager
+
+	@property
+	def uuid(self):
+		# Most entities never need one, so it is only generated on first use
+		if self._uuid is None:
+			if self.sequential_uuids:
+				self._uuid = uuid.UUID(int=next(_uuid_counter))
+			else:
+				self._uuid = uuid.uuid4()
+		return self._uuid
+
 	@property
 	def events(self):
 		return self.base_events + self._events
@@ -31,10 +84,68 @@ class Entity(object):
 			i = slot._getattr(attr, i)
 		if self.silenced:
 			return i
-		return getattr(self.data.scripts, attr, lambda s, x: x)(self, i)
+		script = getattr(self.data.scripts, attr, None)
+		if script is None:
+			return i
+		return _run_stat_script(self, script, i)
+
+	def _stat_is_static(self, attr):
+		"""
+		Returns whether \a attr only depends on the entity's tags and buffs.
+		Values computed by card scripts are never cached.
+		"""
+		if not self.cache_stats:
+			return False
+		if hasattr(self.data.scripts, attr):
+			return False
+		for slot in self.slots:
+			if not slot._stat_is_static(attr):
+				return False
+		return True
+
+	def invalidate_stats(self):
+		"""
+		Drop the cached int and boolean properties of the entity.
+		Called whenever its tags, buffs or silence/enrage state change.
+		"""
+		self._stat_cache.clear()
+		self.notify_change()
+
+	def notify_change(self):
+		"""
+		Record that the tags of the entity may have changed: bumps the
+		state_version of its game and, if the game tracks changes, records
+		the entity. Attribute writes are recorded automatically.
+		"""
+		changes = self._changes
+		if changes is not None:
+			changes[id(self)] = self
+		try:
+			self.game.state_version += 1
+		except AttributeError:
+			# Not in a game yet
+			pass
 
-	def log(self, message, *args):
-		self.logger.info(message, *args)
+	def zones_changed(self, zones):
+		"""
+		Drop the cached zone properties of the entity which depend on any
+		of \a zones, after a card moved from or to them.
+		"""
+		caches = self._zone_caches
+		if caches:
+			cls = self.__class__
+			dependents = _zone_dependents.get((cls, zones))
+			if dependents is None:
+				dependents = _get_zone_dependents(cls, zones)
+			for attr in dependents:
+				caches.pop(attr, None)
+
+	def log(self, message, *args, level=logging.INFO):
+		"""
+		Log \a message, formatted with \a args, unless the game is headless.
+		"""
+		if not self.game.headless:
+			self.logger.log(level, message, *args)
 
 	def trigger_event(self, source, event, args):
 		"""
@@ -43,25 +154,53 @@ class Entity(object):
 		* \a event: The event being triggered
 		* \a args: A list of arguments to pass to the callback
 		"""
-		actions = []
-		for action in event.actions:
-			if callable(action):
-				ac = action(self, *args)
-				if not ac:
-					# Handle falsy returns
-					continue
-				if not hasattr(ac, "__iter__"):
-					actions.append(ac)
+		from .actions import resolve
+		resolve(self._trigger_event(source, event, args))
+
+	def _trigger_event(self, source, event, args):
+		manager = source.game.manager
+		tracing = manager.tracers
+		if tracing:
+			name = self.data.id if self.data is not None else self.__class__.__name__
+			manager.trace("script:event", name, self)
+		try:
+			actions = []
+			for action in event.actions:
+				if callable(action):
+					ac = action(self, *args)
+					if not ac:
+						# Handle falsy returns
+						continue
+					if not hasattr(ac, "__iter__"):
+						actions.append(ac)
+					else:
+						actions += action(self, *args)
 				else:
-					actions += action(self, *args)
-			else:
-				actions.append(action)
-		# XXX This is racey. Replace with something more solid.
-		self.event_args = args
-		source.game.queue_actions(self, actions)
-		self.event_args = None
-		if event.once:
-			self._events.remove(event)
+					actions.append(action)
+			# XXX This is racey. Replace with something more solid.
+			self.event_args = args
+			yield source.game._queue_actions(self, actions)
+			self.event_args = None
+			if event.once:
+				self._events.remove(event)
+				source.game.refresh_listeners(self)
+		finally:
+			if tracing:
+				manager.trace_end("script:event", name, self)
+
+
+def _run_stat_script(entity, script, value):
+	"""
+	Returns the \a value of a stat as modified by the \a script of \a entity.
+	"""
+	manager = entity.game.manager
+	if not manager.tracers:
+		return script(entity, value)
+	manager.trace("script:stat", entity.id, entity)
+	try:
+		return script(entity, value)
+	finally:
+		manager.trace_end("script:stat", entity.id, entity)
 
 
 def slot_property(attr, f=any):
@@ -74,13 +213,23 @@ def slot_property(attr, f=any):
 def boolean_property(attr):
 	@property
 	def func(self):
-		return getattr(self, "_" + attr, False) \
-			or any(getattr(slot, attr, False) for slot in self.slots) \
-			or getattr(self.data.scripts, attr, lambda s, x: x)(self, False)
+		cache = self._stat_cache
+		if attr in cache:
+			return cache[attr]
+		ret = getattr(self, "_" + attr, False) \
+			or any(getattr(slot, attr, False) for slot in self.slots)
+		if not ret:
+			script = getattr(self.data.scripts, attr, None)
+			if script is not None:
+				ret = _run_stat_script(self, script, False)
+		if self._stat_is_static(attr):
+			cache[attr] = ret
+		return ret
 
 	@func.setter
 	def func(self, value):
 		setattr(self, "_" + attr, value)
+		self.invalidate_stats()
 
 	return func
 
@@ -88,11 +237,58 @@ def boolean_property(attr):
 def int_property(attr):
 	@property
 	def func(self):
-		ret = self._getattr(attr, 0)
-		return max(0, ret)
+		cache = self._stat_cache
+		if attr in cache:
+			return cache[attr]
+		ret = max(0, self._getattr(attr, 0))
+		if self._stat_is_static(attr):
+			cache[attr] = ret
+		return ret
 
 	@func.setter
 	def func(self, value):
 		setattr(self, "_" + attr, value)
+		self.invalidate_stats()
 
 	return func
+
+
+def zone_property(*zones):
+	"""
+	A property caching the list returned by the decorated function until a
+	card moves from or to one of \a zones, among the cards of the entity
+	(a player) or of the whole game. The cached list is shared and must
+	not be modified. See Entity.zones_changed().
+	"""
+	def decorator(func):
+		attr = func.__name__
+
+		@property
+		def prop(self):
+			if self.game.zone_moves:
+				# Zone containers may be out of sync until the move is done
+				return func(self)
+			caches = self._zone_caches
+			ret = caches.get(attr)
+			if ret is None:
+				ret = caches[attr] = func(self)
+			return ret
+
+		prop.fget.zones = zones
+		return prop
+
+	return decorator
+
+
+# The zone properties of a class depending on some zones, by (class, zones)
+_zone_dependents = {}
+
+
+def _get_zone_dependents(cls, zones):
+	ret = []
+	for name in dir(cls):
+		prop = getattr(cls, name, None)
+		if isinstance(prop, property) and set(getattr(prop.fget, "zones", ())) & set(zones):
+			ret.append(name)
+	ret = _zone_dependents[cls, zones] = tuple(ret)
+	return ret
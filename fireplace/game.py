@@ -1,27 +1,142 @@
+import logging
 import random
 import time
 from calendar import timegm
 from itertools import chain
-from .actions import Attack, BeginTurn, Death, EndTurn, EventListener
+from operator import itemgetter
+from . import journal
+from .journal import Journal
+from .actions import Action, Attack, BeginTurn, Death, EndTurn, EventListener, MulliganChoice, resolve
+from .aura import Aura
 from .card import THE_COIN
-from .entity import Entity
+from .entity import Entity, zone_property
 from .enums import CardType, PlayState, State, Step, Zone
-from .managers import GameManager
-from .utils import CardList
+from .managers import GameManager, Manager
+from .utils import CardList, IndexedCardList
+
+
+# Zones in which cards may receive event broadcasts
+LISTENING_ZONES = (Zone.PLAY, Zone.HAND, Zone.SECRET)
+
+# Objects holding per-game state, copied by BaseGame.clone(). Anything
+# else reachable from the game (card definitions, scripts, actions and
+# selectors, enums...) is immutable and shared with the clone.
+CLONED_TYPES = (Entity, Manager, Aura, Journal, MulliganChoice)
 
 
 class GameOver(Exception):
 	pass
 
 
+# How clone_state() copies instances of a class, see _clone_kind()
+_SHARED, _TUPLE, _LIST, _DICT, _SET, _OBJECT = range(6)
+_clone_kinds = {}
+
+
+def _clone_kind(cls):
+	kind = _clone_kinds.get(cls)
+	if kind is None:
+		if cls is tuple:
+			kind = _TUPLE
+		elif issubclass(cls, list):
+			kind = _LIST
+		elif cls is dict:
+			kind = _DICT
+		elif cls is set:
+			kind = _SET
+		elif issubclass(cls, CLONED_TYPES):
+			kind = _OBJECT
+		else:
+			kind = _SHARED
+		_clone_kinds[cls] = kind
+	return kind
+
+
+def clone_state(obj, memo):
+	"""
+	Returns a copy of \a obj for a cloned game. Containers and CLONED_TYPES
+	objects are copied, everything else is shared.
+	\a memo maps the id() of already copied objects to their copy.
+	"""
+	ret = memo.get(id(obj))
+	if ret is not None:
+		return ret
+
+	cls = obj.__class__
+	kind = _clone_kinds.get(cls) or _clone_kind(cls)
+	if kind == _SHARED:
+		return obj
+	elif kind == _TUPLE:
+		return tuple([clone_state(v, memo) for v in obj])
+	elif kind == _LIST:
+		ret = memo[id(obj)] = list.__new__(cls)
+		list.extend(ret, [
+			v if _clone_kinds.get(v.__class__) == _SHARED else clone_state(v, memo)
+			for v in obj
+		])
+		if cls is not list:
+			_clone_attributes(obj, ret, memo)
+			if isinstance(ret, IndexedCardList):
+				ret._rebuild()
+		return ret
+	elif kind == _DICT:
+		ret = memo[id(obj)] = obj.copy()
+		for k, v in obj.items():
+			if _clone_kinds.get(v.__class__) != _SHARED:
+				ret[k] = clone_state(v, memo)
+		return ret
+	elif kind == _SET:
+		# Sets only ever hold hashable keys, never cards
+		return set(obj)
+
+	ret = memo[id(obj)] = cls.__new__(cls)
+	if cls is Journal:
+		# Checkpoints are not carried over
+		ret.game = clone_state(obj.game, memo)
+		ret.levels = []
+		return ret
+	_clone_attributes(obj, ret, memo)
+	if isinstance(obj, Manager):
+		# Observers follow the original game only
+		ret.observers = []
+	elif cls is Aura and hasattr(obj, "_buffs"):
+		# The buff map is keyed by id() of the targets
+		ret._buffs = {id(memo[k]): buff for k, buff in ret._buffs.items()}
+	return ret
+
+
+def _clone_attributes(obj, ret, memo):
+	attrs = obj.__dict__.copy()
+	if isinstance(obj, IndexedCardList):
+		del attrs["_counts"]
+		del attrs["_positions"]
+	elif "_zone_caches" in attrs:
+		# Cheaper to rebuild than to copy
+		attrs["_zone_caches"] = {}
+	for k, v in attrs.items():
+		if _clone_kinds.get(v.__class__) != _SHARED:
+			copy = memo.get(id(v))
+			attrs[k] = clone_state(v, memo) if copy is None else copy
+	ret.__dict__ = attrs
+
+
 class BaseGame(Entity):
 	type = CardType.GAME
 	MAX_MINIONS_ON_FIELD = 7
 	Manager = GameManager
+	# Skip all engine logging. Set it on a game, or on BaseGame for every
+	# game of the process.
+	headless = False
 
-	def __init__(self, players):
+	def __init__(self, players, seed=None):
 		self.data = None
 		super().__init__()
+		if seed is None:
+			seed = random.getrandbits(64)
+		# All random draws of the game go through self.random, so that a
+		# game can be replayed from its decks and seed.
+		self.seed = seed
+		self.random = random.Random(seed)
 		self.players = players
 		for player in players:
 			player.game = self
@@ -30,9 +145,22 @@ class BaseGame(Entity):
 		self.next_step = None
 		self.turn = 0
 		self.current_player = None
-		self.auras = []
-		self.minions_killed_this_turn = CardList()
+		self.auras = IndexedCardList()
+		self.minions_killed_this_turn = IndexedCardList()
 		self.no_aura_refresh = False
+		self.zone_moves = 0
+		self.zone_version = 0
+		# Bumped after every action and on tag changes, see Player.options()
+		self.state_version = 0
+		self.entities_by_id = {self.entity_id: self}
+		self._listeners = {}
+		# Sets self._journal
+		Journal(self).add(self)
+		for player in players:
+			self._journal.add(player)
+		self.refresh_listeners(self)
+		for player in players:
+			self.refresh_listeners(player)
 
 	def __repr__(self):
 		return "%s(players=%r)" % (self.__class__.__name__, self.players)
@@ -44,38 +172,132 @@ class BaseGame(Entity):
 	def game(self):
 		return self
 
-	@property
+	@zone_property(Zone.PLAY)
 	def board(self):
 		return CardList(chain(self.players[0].field, self.players[1].field))
 
-	@property
+	@zone_property(Zone.DECK)
 	def decks(self):
 		return CardList(chain(self.players[0].deck, self.players[1].deck))
 
-	@property
+	@zone_property(Zone.HAND)
 	def hands(self):
 		return CardList(chain(self.players[0].hand, self.players[1].hand))
 
-	@property
+	@zone_property(Zone.PLAY)
 	def characters(self):
 		return CardList(chain(self.players[0].characters, self.players[1].characters))
 
-	@property
+	@zone_property(Zone.PLAY, Zone.SECRET, Zone.HAND, Zone.DECK, Zone.GRAVEYARD)
 	def all_entities(self):
 		return CardList(chain(self.entities, self.hands, self.decks, self.graveyard))
 
-	@property
+	@zone_property(Zone.GRAVEYARD)
 	def graveyard(self):
 		return CardList(chain(self.players[0].graveyard, self.players[1].graveyard))
 
-	@property
+	@zone_property(Zone.PLAY, Zone.SECRET)
 	def entities(self):
 		return CardList(chain([self], self.players[0].entities, self.players[1].entities))
 
-	@property
+	@zone_property(Zone.PLAY)
 	def live_entities(self):
 		return CardList(chain(self.players[0].live_entities, self.players[1].live_entities))
 
+	def entity(self, id):
+		"""
+		Returns the entity with the entity ID \a id.
+		Raises KeyError if there is no such entity, or if it was removed
+		from the game.
+		"""
+		return self.entities_by_id[id]
+
+	def clone(self):
+		"""
+		Returns an independent, playable copy of the game.
+		Card definitions and scripts are shared, observers registered on
+		the managers are not carried over. Cannot be used while actions
+		are being processed.
+		"""
+		assert not self.zone_moves
+		memo = {}
+		ret = clone_state(self, memo)
+		if ret._changes is not None:
+			# The changes are keyed by id() of the entities, and shared
+			# by all of them
+			changes = list(ret._changes.values())
+			ret._changes.clear()
+			for entity in changes:
+				ret._changes[id(entity)] = entity
+		ret.random = random.Random()
+		ret.random.setstate(self.random.getstate())
+		return ret
+
+	def checkpoint(self):
+		"""
+		Start journaling changes to the game state and return a checkpoint
+		which rollback() can restore. Checkpoints can be nested.
+		Cannot be used while actions are being processed.
+		"""
+		assert not self.zone_moves
+		return self._journal.checkpoint()
+
+	def commit(self, checkpoint):
+		"""
+		Keep the changes made since \a checkpoint and forget about it, and
+		about any checkpoint taken after it.
+		"""
+		self._journal.commit(checkpoint)
+
+	def rollback(self, checkpoint):
+		"""
+		Restore the game to the exact state it was in at \a checkpoint,
+		including entity IDs. Observers are not notified. Checkpoints taken
+		after \a checkpoint are discarded.
+		"""
+		assert not self.zone_moves
+		changes = self._changes
+		self._journal.rollback(checkpoint)
+		# Derived state is not journaled, drop it
+		for entity in self.entities_by_id.values():
+			entity._stat_cache.clear()
+			entity._zone_caches.clear()
+		for aura in self.auras:
+			aura._state = None
+		if changes is not None:
+			# Keep tracking changes, and record every entity as changed
+			for entity in self.entities_by_id.values():
+				entity._changes = changes
+
+	def track_changes(self):
+		"""
+		Start recording which entities are modified, see flush_changes().
+		Call untrack_changes() once done.
+		"""
+		changes = {}
+		for entity in self.entities_by_id.values():
+			entity._changes = changes
+
+	def untrack_changes(self):
+		"""
+		Stop recording which entities are modified.
+		"""
+		for entity in self.entities_by_id.values():
+			entity._changes = None
+
+	def flush_changes(self):
+		"""
+		Returns the entities modified since the last call, or since
+		track_changes(). Tags computed from other entities, such as a
+		player's spell power, may change without their entity being
+		recorded. Always empty if the game does not track its changes.
+		"""
+		if self._changes is None:
+			return []
+		ret = list(self._changes.values())
+		self._changes.clear()
+		return ret
+
 	def filter(self, *args, **kwargs):
 		return self.all_entities.filter(*args, **kwargs)
 
@@ -99,9 +321,9 @@ class BaseGame(Entity):
 		# Save the attacker/defender atk values in case they change during the attack
 		# (eg. in case of Enrage)
 		def_atk = defender.atk
-		attacker.hit(defender, attacker.atk)
+		yield attacker._hit_target(defender, attacker.atk)
 		if def_atk:
-			defender.hit(attacker, def_atk)
+			yield defender._hit_target(attacker, def_atk)
 		attacker.attacking = False
 		defender.defending = False
 		attacker.num_attacks += 1
@@ -145,15 +367,42 @@ class BaseGame(Entity):
 			raise GameOver("The game has ended.")
 
 	def process_deaths(self):
-		actions = []
-		for card in self.live_entities:
-			if card.to_be_destroyed:
-				actions += self._schedule_death(card)
-
-		self.check_for_end_game()
+		task = self._process_deaths()
+		if task is not None:
+			resolve(task)
 
+	def _process_deaths(self):
+		"""
+		Schedule the death of the cards to be destroyed and returns the
+		task processing them, if any.
+		"""
+		tracing = self.manager.tracers
+		if tracing:
+			self.manager.trace("deaths", "process_deaths", self)
+		try:
+			actions = []
+			for card in self.live_entities:
+				if card.to_be_destroyed:
+					actions += self._schedule_death(card)
+
+			self.check_for_end_game()
+		except BaseException:
+			if tracing:
+				self.manager.trace_end("deaths", "process_deaths", self)
+			raise
+
+		if tracing:
+			return self._traced_deaths(actions)
 		if actions:
-			self.queue_actions(self, actions)
+			return self._queue_actions(self, actions)
+		return None
+
+	def _traced_deaths(self, actions):
+		try:
+			if actions:
+				yield self._queue_actions(self, actions)
+		finally:
+			self.manager.trace_end("deaths", "process_deaths", self)
 
 	def _schedule_death(self, card):
 		"""
@@ -161,7 +410,7 @@ class BaseGame(Entity):
 		trigger attached to the Game object.
 		Returns a list of actions to perform during the death sweep.
 		"""
-		self.logger.debug("Scheduling death for %r", card)
+		self.log("Scheduling death for %r", card, level=logging.DEBUG)
 		card.ignore_events = True
 		card.zone = Zone.GRAVEYARD
 		if card.type == CardType.MINION:
@@ -176,6 +425,9 @@ class BaseGame(Entity):
 		"""
 		Queue a list of \a actions for processing from \a source.
 		"""
+		return resolve(self._queue_actions(source, actions))
+
+	def _queue_actions(self, source, actions):
 		ret = []
 		if not hasattr(actions, "__iter__"):
 			actions = (actions, )
@@ -192,12 +444,102 @@ class BaseGame(Entity):
 				else:
 					listener = source
 				listener._events.append(action)
+				self.refresh_listeners(listener)
 			else:
-				ret.append(action.trigger(source))
+				ret.append((yield action._trigger(source)))
+				self.state_version += 1
 				self.refresh_auras()
 
 		return ret
 
+	def refresh_listeners(self, entity):
+		"""
+		Update the event listener registry with the current events of \a entity.
+		Listeners are indexed by every Action class their trigger is an
+		instance of, so that broadcasts only visit entities which can match.
+		"""
+		keys = set()
+		if entity.type in (CardType.GAME, CardType.PLAYER) or entity.zone in LISTENING_ZONES:
+			for event in entity.events:
+				if not isinstance(event, EventListener):
+					continue
+				for cls in type(event.trigger).__mro__:
+					if cls is Action:
+						break
+					keys.add((cls, event.at))
+
+		for key in entity._listener_keys - keys:
+			self._listeners[key].remove(entity)
+		if keys - entity._listener_keys:
+			journal.touch(self, self._listeners)
+		for key in keys - entity._listener_keys:
+			listeners = self._listeners.get(key)
+			if listeners is None:
+				listeners = self._listeners[key] = IndexedCardList()
+				self._journal.add(listeners)
+			listeners.append(entity)
+		entity._listener_keys = keys
+
+	def get_listeners(self, action, at, hands=False):
+		"""
+		Returns the entities listening for \a action at \a at, in the order
+		they appear in self.entities (or self.hands if \a hands is True).
+		"""
+		entities = self._listeners.get((action, at))
+		if not entities:
+			return []
+		ret = []
+		for entity in entities:
+			position = self._listener_position(entity, hands)
+			if position is not None:
+				ret.append((position, entity))
+		ret.sort(key=itemgetter(0))
+		return [entity for position, entity in ret]
+
+	def _listener_position(self, entity, hands=False):
+		if entity is self:
+			return None if hands else (0, )
+		if entity.type == CardType.PLAYER:
+			return None if hands else (self.players.index(entity) + 1, 3)
+
+		if entity.type == CardType.ENCHANTMENT:
+			# Buffs are only visible on minions in play and on heroes
+			owner = entity.owner
+			if hands or owner.type not in (CardType.HERO, CardType.MINION):
+				return None
+			position = self._listener_position(owner)
+			if position is None:
+				return None
+			if owner.type == CardType.HERO:
+				# After the hero power and weapon, as in Hero.entities
+				position = position[:-1] + (3, )
+			return position + (owner.buffs.index(entity), )
+
+		player = entity.controller
+		try:
+			if hands:
+				if entity.zone == Zone.HAND:
+					return (self.players.index(player), player.hand.index(entity))
+				return None
+			i = self.players.index(player) + 1
+			if entity.type == CardType.HERO:
+				if player.hero is entity:
+					return (i, 0, 0)
+			elif entity.type == CardType.HERO_POWER:
+				if player.hero and player.hero.power is entity:
+					return (i, 0, 1)
+			elif entity.type == CardType.WEAPON:
+				if player.hero and player.weapon is entity:
+					return (i, 0, 2)
+			elif entity.zone == Zone.PLAY:
+				if entity.type == CardType.MINION:
+					return (i, 1, player.field.index(entity))
+			elif entity.zone == Zone.SECRET:
+				return (i, 2, player.secrets.index(entity))
+		except ValueError:
+			pass
+		return None
+
 	def pick_first_player(self):
 		"""
 		Picks and returns first player, second player
@@ -209,8 +551,22 @@ class BaseGame(Entity):
 	def refresh_auras(self):
 		if self.no_aura_refresh:
 			return
-		for aura in self.auras:
-			aura.update()
+		if not self.manager.tracers:
+			for aura in self.auras:
+				aura.update()
+			return
+
+		self.manager.trace("aura", "refresh_auras", self)
+		try:
+			for aura in self.auras:
+				source = aura.source
+				self.manager.trace("script:aura", source.id, source)
+				try:
+					aura.update()
+				finally:
+					self.manager.trace_end("script:aura", source.id, source)
+		finally:
+			self.manager.trace_end("aura", "refresh_auras", self)
 
 	def prepare(self):
 		self.players[0].opponent = self.players[1]
@@ -272,7 +628,7 @@ class BaseGame(Entity):
 		self.log("%s begins turn %i", player, self.turn)
 		self.manager.step(self.next_step, Step.MAIN_ACTION)
 		self.current_player = player
-		self.minions_killed_this_turn = CardList()
+		self.minions_killed_this_turn = IndexedCardList()
 
 		for p in self.players:
 			p.cards_drawn_this_turn = 0
@@ -305,7 +661,7 @@ class CoinRules:
 	The second player gets "The Coin" (GAME_005).
 	"""
 	def pick_first_player(self):
-		winner = random.choice(self.players)
+		winner = self.random.choice(self.players)
 		self.log("Tossing the coin... %s wins!", winner)
 		return winner, winner.opponent
 
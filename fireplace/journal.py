@@ -0,0 +1,118 @@
+"""
+Journal of game state changes, used by BaseGame.checkpoint() and rollback().
+
+Every game has its own Journal, which the objects holding its state refer
+to once they are part of the game: entities from GameManager.new_entity(),
+their IndexedCardLists and auras along with them. While the game has open
+checkpoints, each of these objects is snapshotted the first time it is
+modified after the latest checkpoint: entities and auras on attribute
+writes, IndexedCardLists on mutation and the game's lookup dicts and
+manager through touch(). Rolling back restores the snapshots in place.
+
+Nothing is recorded for games without open checkpoints, nor for objects
+which joined the game after the latest checkpoint: once the references to
+them are restored, they are simply no longer part of the game. The state
+of the game's random number generator is saved with every checkpoint.
+"""
+from .utils import IndexedCardList
+
+
+class Journal:
+	def __init__(self, game):
+		self.game = game
+		# One (touched ids, snapshots, random state) per open checkpoint.
+		# The snapshots keep the objects alive, so their id() cannot be
+		# reused meanwhile.
+		self.levels = []
+
+	def touch(self, obj):
+		"""
+		Record the state of \a obj before it is modified, if it was not
+		recorded yet since the latest checkpoint.
+		"""
+		if not self.levels:
+			return
+		touched, snapshots, random_state = self.levels[-1]
+		key = id(obj)
+		if key in touched:
+			return
+		touched.add(key)
+		if isinstance(obj, dict):
+			snapshot = obj.copy()
+		elif isinstance(obj, list):
+			snapshot = (list(obj), obj.__dict__.copy())
+		else:
+			snapshot = obj.__dict__.copy()
+		snapshots.append((obj, snapshot))
+
+	def add(self, obj):
+		"""
+		Journal the changes to \a obj, which joins the game, and to its
+		IndexedCardLists. Nothing is recorded for them until the next
+		checkpoint, as they were not part of the game before.
+		"""
+		if obj._journal is self:
+			return
+		touched = self.levels[-1][0] if self.levels else None
+		obj._journal = self
+		if touched is not None:
+			touched.add(id(obj))
+		for value in obj.__dict__.values():
+			if isinstance(value, IndexedCardList) and value._journal is not self:
+				value._journal = self
+				if touched is not None:
+					touched.add(id(value))
+			elif touched is not None and isinstance(value, dict):
+				touched.add(id(value))
+
+	def checkpoint(self):
+		self.levels.append((set(), [], self.game.random.getstate()))
+		return len(self.levels) - 1
+
+	def commit(self, level):
+		"""
+		Fold the checkpoints from \a level up into the previous one.
+		"""
+		assert level < len(self.levels)
+		while len(self.levels) > max(level, 1):
+			touched, snapshots, random_state = self.levels.pop()
+			parent_touched, parent_snapshots, parent_random_state = self.levels[-1]
+			for obj, snapshot in snapshots:
+				if id(obj) not in parent_touched:
+					parent_snapshots.append((obj, snapshot))
+			# Objects which joined the game are not recorded either
+			parent_touched |= touched
+		if level == 0:
+			self.levels.pop()
+
+	def rollback(self, level):
+		"""
+		Undo every change made since checkpoint \a level.
+		"""
+		assert level < len(self.levels)
+		while len(self.levels) > level:
+			touched, snapshots, random_state = self.levels.pop()
+			self.game.random.setstate(random_state)
+			for obj, snapshot in reversed(snapshots):
+				if isinstance(obj, dict):
+					dict.clear(obj)
+					dict.update(obj, snapshot)
+				elif isinstance(obj, list):
+					items, attrs = snapshot
+					list.__setitem__(obj, slice(None), items)
+					obj.__dict__.clear()
+					obj.__dict__.update(attrs)
+					obj._rebuild()
+				else:
+					obj.__dict__.clear()
+					obj.__dict__.update(snapshot)
+
+
+def touch(owner, obj):
+	"""
+	Record the state of \a obj before it is modified, if \a owner is part
+	of a game.
+	"""
+	journal = owner._journal
+	if journal is not None:
+		journal.touch(obj)
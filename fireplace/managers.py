@@ -1,3 +1,4 @@
+from . import journal
 from .enums import GameTag
 
 
@@ -52,22 +53,62 @@ class GameManager(Manager):
 	def __init__(self, obj):
 		super().__init__(obj)
 		self.counter = 1
+		# Observers also timing the engine, see trace()
+		self.tracers = []
 		obj.entity_id = self.counter
 
-	def action(self, type, *args):
+	def register(self, observer):
+		super().register(observer)
+		if hasattr(observer, "enter"):
+			self.tracers.append(observer)
+
+	def action(self, action, *args):
 		for observer in self.observers:
-			observer.action(type, args)
+			observer.action(action.type, args)
+		for tracer in self.tracers:
+			tracer.enter("action", action.__class__.__name__, args[0])
 
-	def action_end(self, type, *args):
+	def action_end(self, action, *args):
 		for observer in self.observers:
-			observer.action_end(type, args)
+			observer.action_end(action.type, args)
+		for tracer in self.tracers:
+			tracer.exit("action", action.__class__.__name__, args[0])
+
+	def trace(self, category, name, source):
+		"""
+		Notify the tracers that a \a category operation of the engine
+		(eg. "selector", "deaths") starts, on behalf of \a source.
+		Tracers are observers with enter() and exit() methods.
+		"""
+		for tracer in self.tracers:
+			tracer.enter(category, name, source)
+
+	def trace_end(self, category, name, source):
+		for tracer in self.tracers:
+			tracer.exit(category, name, source)
 
 	def new_entity(self, entity):
+		journal.touch(self.obj, self)
 		self.counter += 1
 		entity.entity_id = self.counter
+		journal.touch(self.obj, self.obj.entities_by_id)
+		self.obj.entities_by_id[entity.entity_id] = entity
+		self.obj._journal.add(entity)
+		if self.obj._changes is not None:
+			entity._changes = self.obj._changes
 		for observer in self.observers:
 			observer.new_entity(entity)
 
+	def remove_entity(self, entity):
+		"""
+		Retire \a entity from the game's ID lookup table.
+		Entity IDs are never reused.
+		"""
+		for observer in self.observers:
+			observer.remove_entity(entity)
+		journal.touch(self.obj, self.obj.entities_by_id)
+		self.obj.entities_by_id.pop(entity.entity_id, None)
+
 	def start_game(self):
 		for observer in self.observers:
 			observer.start_game()
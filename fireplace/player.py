@@ -1,14 +1,20 @@
-import random
+from collections import namedtuple
 from itertools import chain
 from .actions import Draw, Give, Steal, Summon
 from .card import Card
 from .deck import Deck
 from .entity import Entity
-from .enums import CardType, PlayState, Zone
-from .entity import slot_property
+from .enums import CardType, OptionType, PlayState, State, Zone
+from .entity import slot_property, zone_property
 from .managers import PlayerManager
 from .targeting import *
-from .utils import CardList
+from .utils import CardList, IndexedCardList
+
+
+# A legal option of a player. \a entity is the card to play, the character
+# to attack with, the hero power to use or the pending choice, or None
+# for END_TURN. \a targets are its valid targets, if it needs one.
+Option = namedtuple("Option", ("type", "entity", "targets"))
 
 
 class Player(Entity):
@@ -25,11 +31,11 @@ class Player(Entity):
 		super().__init__()
 		self.name = name
 		self.deck = Deck()
-		self.hand = CardList()
-		self.field = CardList()
-		self.graveyard = CardList()
-		self.secrets = CardList()
-		self.buffs = []
+		self.hand = IndexedCardList()
+		self.field = IndexedCardList()
+		self.graveyard = IndexedCardList()
+		self.secrets = IndexedCardList()
+		self.buffs = IndexedCardList()
 		self.choice = None
 		self.start_hand_size = 4
 		self.max_hand_size = 10
@@ -40,11 +46,13 @@ class Player(Entity):
 		self.hero = None
 		self.last_card_played = None
 		self.overloaded = 0
+		self.overload_locked = 0
 		self._max_mana = 0
 		self.playstate = PlayState.INVALID
 		self.temp_mana = 0
 		self.timeout = 75
 		self.times_hero_power_used_this_game = 0
+		self.used_mana = 0
 		self.minions_killed_this_turn = 0
 		self.weapon = None
 		self.zone = Zone.INVALID
@@ -80,11 +88,11 @@ class Player(Entity):
 	def spellpower(self):
 		return sum(minion.spellpower for minion in self.field)
 
-	@property
+	@zone_property(Zone.PLAY)
 	def characters(self):
 		return CardList(chain([self.hero] if self.hero else [], self.field))
 
-	@property
+	@zone_property(Zone.PLAY, Zone.SECRET)
 	def entities(self):
 		ret = []
 		for entity in self.field:
@@ -92,7 +100,7 @@ class Player(Entity):
 		ret += self.secrets
 		return CardList(chain(list(self.hero.entities) if self.hero else [], ret, [self]))
 
-	@property
+	@zone_property(Zone.PLAY)
 	def live_entities(self):
 		ret = self.field[:]
 		if self.hero:
@@ -105,6 +113,58 @@ class Player(Entity):
 	def minion_slots(self):
 		return max(0, self.game.MAX_MINIONS_ON_FIELD - len(self.field))
 
+	def options(self):
+		"""
+		Returns the list of Options the player can currently take.
+		A pending choice is the only option while it lasts: a POWER option
+		whose entity is the choice itself, and whose targets are the cards
+		to choose from. Hearthstone has no option type for choices, it
+		sends them apart from the options.
+		Choose One cards are a single option: the card to choose from is
+		passed to play() and is not part of the option.
+
+		The list is cached until the game's state_version or zone_version
+		change, or the player's mana. Tags set directly outside of actions
+		must be followed by notify_change() on their entity.
+		"""
+		game = self.game
+		# Mana crystals are often handed out outside of actions
+		key = (game.state_version, game.zone_version, self.mana, self.choice)
+		cache = self._zone_caches.get("options")
+		if cache is None or cache[0] != key:
+			cache = self._zone_caches["options"] = (key, self._get_options())
+		return cache[1][:]
+
+	def _get_options(self):
+		if self.game.state != State.RUNNING:
+			return []
+		if self.choice:
+			return [Option(OptionType.POWER, self.choice, self.choice.cards)]
+		if not self.current_player:
+			return []
+
+		ret = []
+		# The targets of each card are computed once, and only if it may
+		# take one
+		for card in self.hand:
+			targets = card.play_targets()
+			if card.is_playable(targets):
+				if not card.has_target(targets):
+					targets = []
+				ret.append(Option(OptionType.POWER, card, targets))
+		power = self.hero.power
+		targets = power.play_targets()
+		if power.is_usable(targets):
+			if not power.has_target(targets):
+				targets = []
+			ret.append(Option(OptionType.POWER, power, targets))
+		for character in self.characters:
+			targets = character.targets
+			if character.can_attack(targets=targets):
+				ret.append(Option(OptionType.POWER, character, targets))
+		ret.append(Option(OptionType.END_TURN, None, []))
+		return ret
+
 	def card(self, id, source=None, zone=Zone.SETASIDE):
 		card = Card(id)
 		card.controller = self
@@ -188,7 +248,10 @@ class Player(Entity):
 
 	def shuffle_deck(self):
 		self.log("%r shuffles their deck", self)
-		random.shuffle(self.deck)
+		self.game.random.shuffle(self.deck)
+		self.game.zone_version += 1
+		self.game.zones_changed((Zone.DECK, ))
+		self.zones_changed((Zone.DECK, ))
 
 	def summon(self, card):
 		"""
@@ -0,0 +1,340 @@
+"""
+Profiling of the engine, per Action class and per engine operation.
+
+Usage:
+	profiler = Profiler()
+	game.manager.register(profiler)
+	...
+	print(profiler.table())
+
+A Profiler can be registered on any number of games, and profilers of
+different games or processes can be combined with merge().
+CardProfiler only keeps the time spent running card scripts, charged to
+the ID of the card they belong to.
+
+ChromeTrace streams the begin and end of every action (and other engine
+operation) to a file in the Chrome trace event format, which can be opened
+in chrome://tracing or Perfetto:
+	with ChromeTrace("game.json") as trace:
+		game.manager.register(trace)
+		...
+"""
+import json
+from time import perf_counter
+from .enums import Step
+
+
+class Profiler:
+	"""
+	A game observer recording, for every action, selector evaluation, aura
+	refresh and death sweep: its number of calls, cumulative and self wall
+	time and the deepest nesting it was seen at.
+	Cumulative time is only counted for the outermost of recursive calls.
+	"""
+	def __init__(self):
+		# Maps (category, name) to [calls, cumulative, self time, max depth]
+		self.stats = {}
+		# One [key, start time, time spent in children] per open call
+		self._stack = []
+		# Number of open calls per key
+		self._active = {}
+
+	# Game observer interface
+
+	def action(self, type, args):
+		pass
+
+	def action_end(self, type, args):
+		pass
+
+	def new_entity(self, entity):
+		pass
+
+	def remove_entity(self, entity):
+		pass
+
+	def start_game(self):
+		# Calls interrupted by the end of a previous game are never closed
+		self._stack.clear()
+		self._active.clear()
+
+	def game_step(self, step, next_step):
+		pass
+
+	def enter(self, category, name, source):
+		key = (category, name)
+		stats = self.stats.get(key)
+		if stats is None:
+			stats = self.stats[key] = [0, 0.0, 0.0, 0]
+		stats[0] += 1
+		depth = len(self._stack) + 1
+		if depth > stats[3]:
+			stats[3] = depth
+		self._active[key] = self._active.get(key, 0) + 1
+		self._stack.append([key, perf_counter(), 0.0])
+
+	def exit(self, category, name, source):
+		now = perf_counter()
+		key = (category, name)
+		if not self._active.get(key):
+			# Registered during the call
+			return
+		stack = self._stack
+		# Drop the calls which never returned, eg. on GameOver
+		while stack[-1][0] != key:
+			self._close(stack.pop(), now)
+		self._close(stack.pop(), now)
+
+	def _close(self, frame, now):
+		key, start, children = frame
+		elapsed = now - start
+		stats = self.stats[key]
+		stats[2] += elapsed - children
+		self._active[key] -= 1
+		if not self._active[key]:
+			stats[1] += elapsed
+		if self._stack:
+			self._stack[-1][2] += elapsed
+
+	# Results
+
+	def reset(self):
+		self.stats.clear()
+		self.start_game()
+
+	def merge(self, other):
+		"""
+		Add the results of \a other, a Profiler or its rows(), to this one.
+		"""
+		if isinstance(other, Profiler):
+			other = other.rows()
+		for row in other:
+			key = (row["category"], row["name"])
+			stats = self.stats.get(key)
+			if stats is None:
+				stats = self.stats[key] = [0, 0.0, 0.0, 0]
+			stats[0] += row["calls"]
+			stats[1] += row["cumulative"]
+			stats[2] += row["self"]
+			stats[3] = max(stats[3], row["max_depth"])
+
+	def rows(self):
+		"""
+		Returns the results as a list of dicts, by decreasing self time.
+		"""
+		ret = []
+		for (category, name), (calls, cumulative, self_time, depth) in self.stats.items():
+			ret.append({
+				"category": category,
+				"name": name,
+				"calls": calls,
+				"cumulative": cumulative,
+				"self": self_time,
+				"max_depth": depth,
+			})
+		ret.sort(key=lambda row: row["self"], reverse=True)
+		return ret
+
+	def to_json(self):
+		return json.dumps(self.rows())
+
+	def table(self, limit=None):
+		"""
+		Returns the results as a text table, optionally limited to the
+		\a limit rows with the highest self time.
+		"""
+		rows = self.rows()
+		total = sum(row["self"] for row in rows) or 1
+		lines = ["%-18s %-40s %9s %11s %11s %6s %5s" % (
+			"category", "name", "calls", "cumul (ms)", "self (ms)", "self%", "depth"
+		)]
+		for row in rows[:limit]:
+			lines.append("%-18s %-40.40s %9i %11.2f %11.2f %5.1f%% %5i" % (
+				row["category"], row["name"], row["calls"], row["cumulative"] * 1000,
+				row["self"] * 1000, row["self"] * 100 / total, row["max_depth"]
+			))
+		return "\n".join(lines)
+
+
+# Prefix of the categories traced around card scripts
+SCRIPT_CATEGORY = "script:"
+
+
+class CardProfiler(Profiler):
+	"""
+	A Profiler of card scripts only: events, play/activate/inspire actions,
+	deathrattles, auras and stat hooks, reported per card ID.
+	"""
+	def enter(self, category, name, source):
+		if category.startswith(SCRIPT_CATEGORY):
+			super().enter(category, name, source)
+
+	def exit(self, category, name, source):
+		if category.startswith(SCRIPT_CATEGORY):
+			super().exit(category, name, source)
+
+	def merge(self, other):
+		if isinstance(other, Profiler):
+			other = other.rows()
+		super().merge(row for row in other if row["category"].startswith(SCRIPT_CATEGORY))
+
+	def cards(self):
+		"""
+		Returns the results as a list of dicts, one per card ID, by
+		decreasing self time. \a hooks maps each script kind to its self time.
+		"""
+		cards = {}
+		for row in self.rows():
+			card = cards.get(row["name"])
+			if card is None:
+				card = cards[row["name"]] = {"id": row["name"], "calls": 0, "self": 0.0, "hooks": {}}
+			hook = row["category"][len(SCRIPT_CATEGORY):]
+			card["calls"] += row["calls"]
+			card["self"] += row["self"]
+			card["hooks"][hook] = card["hooks"].get(hook, 0.0) + row["self"]
+		ret = list(cards.values())
+		ret.sort(key=lambda card: card["self"], reverse=True)
+		return ret
+
+	def table(self, limit=None):
+		from .cards import db
+
+		cards = self.cards()
+		total = sum(card["self"] for card in cards) or 1
+		lines = ["%-16s %-28s %9s %11s %6s  %s" % (
+			"id", "card", "calls", "self (ms)", "self%", "hooks"
+		)]
+		for card in cards[:limit]:
+			data = db.get(card["id"])
+			hooks = sorted(card["hooks"].items(), key=lambda item: item[1], reverse=True)
+			lines.append("%-16.16s %-28.28s %9i %11.2f %5.1f%%  %s" % (
+				card["id"], data.name if data else "", card["calls"], card["self"] * 1000,
+				card["self"] * 100 / total, " ".join("%s=%.1f" % (k, v * 1000) for k, v in hooks)
+			))
+		return "\n".join(lines)
+
+
+class ChromeTrace:
+	"""
+	A game observer writing every action, with its source, targets and
+	arguments, as nested trace events to \a file (a path or a file object).
+	Events are written as they happen; \a categories optionally restricts
+	the traced operations, eg. ("action", ).
+	Each game traced is shown as a separate process.
+	"""
+	def __init__(self, file, categories=None):
+		if isinstance(file, str):
+			self.file = open(file, "w")
+			self._owned = True
+		else:
+			self.file = file
+			self._owned = False
+		self.categories = categories
+		self.games = 0
+		self._start = perf_counter()
+		# Open events, closed on close() or when the next game starts
+		self._stack = []
+		# Arguments of the action about to be entered
+		self._args = None
+		self._started = False
+		self.file.write("[")
+		self._first = True
+		self._new_game()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, type, value, tb):
+		self.close()
+
+	def _write(self, event):
+		if self._first:
+			self._first = False
+		else:
+			self.file.write(",\n")
+		self.file.write(json.dumps(event))
+
+	def _event(self, phase, category, name, args=None):
+		event = {
+			"name": name,
+			"cat": category,
+			"ph": phase,
+			"ts": (perf_counter() - self._start) * 1000000,
+			"pid": self.games,
+			"tid": 1,
+		}
+		if args:
+			event["args"] = args
+		self._write(event)
+
+	def _new_game(self):
+		self.games += 1
+		self._write({
+			"name": "process_name", "ph": "M", "pid": self.games,
+			"args": {"name": "Game %i" % (self.games)},
+		})
+
+	def _unwind(self):
+		while self._stack:
+			category, name = self._stack.pop()
+			self._event("E", category, name)
+
+	def close(self):
+		self._unwind()
+		self.file.write("]\n")
+		if self._owned:
+			self.file.close()
+		else:
+			self.file.flush()
+
+	# Game observer interface
+
+	def action(self, type, args):
+		# Followed by enter("action", ...) for the same action
+		self._args = args
+
+	def action_end(self, type, args):
+		pass
+
+	def new_entity(self, entity):
+		pass
+
+	def remove_entity(self, entity):
+		pass
+
+	def start_game(self):
+		# The setup of the first game happens before it starts
+		if self._started:
+			self._unwind()
+			self._new_game()
+		self._started = True
+
+	def game_step(self, step, next_step):
+		self._event("i", "step", "%s -> %s" % (Step(step).name, Step(next_step).name))
+
+	def enter(self, category, name, source):
+		if self.categories is not None and category not in self.categories:
+			return
+		args = {"source": repr(source)}
+		if category == "action" and self._args:
+			if len(self._args) > 1:
+				if isinstance(self._args[1], list):
+					args["targets"] = [repr(target) for target in self._args[1]]
+					extra = self._args[2:]
+				else:
+					extra = self._args[1:]
+				if extra:
+					args["args"] = [repr(arg) for arg in extra]
+			self._args = None
+		self._stack.append((category, name))
+		self._event("B", category, name, args)
+
+	def exit(self, category, name, source):
+		key = (category, name)
+		if key not in self._stack:
+			return
+		# Close the events which never returned, eg. on GameOver
+		while self._stack[-1] != key:
+			self._event("E", *self._stack.pop())
+		self._stack.pop()
+		self._event("E", category, name)
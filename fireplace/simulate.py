@@ -0,0 +1,260 @@
+"""
+Batch simulation of games over a process pool.
+
+Usage: python -m fireplace.simulate --games 10000 --hero1 MAGE --hero2 WARRIOR
+
+Every game is seeded from the base seed and its number, so any game of a
+batch can be replayed on its own with play_game().
+"""
+import importlib
+import json
+import os
+import random
+import sys
+from argparse import ArgumentParser
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from .cards import heroes
+from .enums import PlayState, Zone
+from .game import Game, GameOver
+from .player import Player
+from .profiling import CardProfiler, ChromeTrace, Profiler
+from .utils import random_draft
+
+
+# Games still running after that many turns are declared a draw
+MAX_TURNS = 200
+
+GameResult = namedtuple("GameResult", ("seed", "winner", "turns", "players", "error", "profile"))
+GameResult.__new__.__defaults__ = (None, )
+GameResult.__doc__ = """
+Outcome of a simulated game. \a winner is the index of the winning player
+in the matchup, or None for a draw. \a error is the repr() of the exception
+which interrupted the game, if any. \a profile holds the Profiler.rows() of
+the game, when profiled.
+"""
+
+
+def random_agent(player):
+	"""
+	Plays the mulligan or the turn of \a player at random.
+	All the draws go through the game's random number generator, so that
+	games replay identically from their seed.
+	"""
+	random = player.game.random
+	if player.choice:
+		cards = player.choice.cards
+		player.choice.choose(*random.sample(cards, random.randint(0, len(cards))))
+		return
+
+	heropower = player.hero.power
+	if heropower.is_usable():
+		if heropower.has_target():
+			heropower.use(target=random.choice(heropower.targets))
+		else:
+			heropower.use()
+
+	for card in player.hand[:]:
+		if card.zone == Zone.HAND and card.is_playable():
+			if card.has_target():
+				card.play(target=random.choice(card.targets))
+			else:
+				card.play()
+
+	for character in player.characters[:]:
+		if character.can_attack():
+			character.attack(random.choice(character.targets))
+
+
+def _player_stats(player):
+	return {
+		"name": player.name,
+		"hero": player.hero.id,
+		"playstate": PlayState(player.playstate).name,
+		"health": player.hero.health,
+		"armor": player.hero.armor,
+		"hand": len(player.hand),
+		"deck": len(player.deck),
+		"field": len(player.field),
+		"fatigue": player.fatigue_counter,
+	}
+
+
+def play_game(deck1, hero1, deck2, hero2, seed, agent=random_agent, max_turns=MAX_TURNS, headless=True, profile=False, trace=None):
+	"""
+	Plays a full game between \a deck1 and \a deck2, with \a agent taking
+	the decisions of both players, and returns its GameResult.
+	Set \a headless to False to log the game, eg. when replaying it.
+	Set \a profile to True to time the engine (see fireplace.profiling).
+	Set \a trace to a path to write the actions of the game to it, as a
+	Chrome trace.
+	"""
+	player1 = Player(name="Player1")
+	player1.prepare_deck(deck1, hero1)
+	player2 = Player(name="Player2")
+	player2.prepare_deck(deck2, hero2)
+	game = Game(players=(player1, player2), seed=seed)
+	game.headless = headless
+	profiler = None
+	if profile:
+		profiler = Profiler()
+		game.manager.register(profiler)
+	tracer = None
+	if trace is not None:
+		tracer = ChromeTrace(trace)
+		game.manager.register(tracer)
+	error = None
+
+	try:
+		game.start()
+		for player in game.players:
+			agent(player)
+		while game.turn <= max_turns:
+			agent(game.current_player)
+			game.end_turn()
+	except GameOver:
+		pass
+	except Exception as e:
+		error = repr(e)
+	finally:
+		if tracer is not None:
+			tracer.close()
+
+	winner = None
+	for i, player in enumerate(game.players):
+		if player.playstate == PlayState.WON:
+			winner = i
+	players = [_player_stats(player) for player in game.players]
+	if profiler is not None:
+		profile = profiler.rows()
+	else:
+		profile = None
+	return GameResult(seed, winner, game.turn, players, error, profile)
+
+
+def _play(matchup, seed):
+	deck1, hero1, deck2, hero2, agent, max_turns, profile, trace_dir = matchup
+	trace = None
+	if trace_dir is not None:
+		trace = os.path.join(trace_dir, "game-%i.json" % (seed))
+	return play_game(deck1, hero1, deck2, hero2, seed, agent, max_turns, profile=profile, trace=trace)
+
+
+def simulate(deck1, hero1, deck2, hero2, games, agent=random_agent, seed=0, workers=None, max_turns=MAX_TURNS, profile=False, trace_dir=None):
+	"""
+	Plays \a games games of the matchup over a pool of \a workers processes
+	(defaults to the number of CPUs), and yields their GameResult as they
+	finish. Game number i is seeded with \a seed + i.
+	\a agent must be picklable, eg. a module-level function.
+	With \a trace_dir, the Chrome trace of every game is written to
+	game-<seed>.json in that directory.
+	"""
+	matchup = (deck1, hero1, deck2, hero2, agent, max_turns, profile, trace_dir)
+	seeds = iter(range(seed, seed + games))
+	if workers == 1:
+		for game_seed in seeds:
+			yield _play(matchup, game_seed)
+		return
+
+	workers = workers or os.cpu_count()
+	with ProcessPoolExecutor(workers) as pool:
+		# Keep the queue short so results stream back as soon as possible
+		pending = set()
+		for game_seed in seeds:
+			# The matchup is small, send it along with every game
+			pending.add(pool.submit(_play, matchup, game_seed))
+			if len(pending) >= workers * 2:
+				done, pending = wait(pending, return_when=FIRST_COMPLETED)
+				for future in done:
+					yield future.result()
+		while pending:
+			done, pending = wait(pending, return_when=FIRST_COMPLETED)
+			for future in done:
+				yield future.result()
+
+
+def _hero(name):
+	return getattr(heroes, name.upper(), name)
+
+
+def _deck(path, hero, rng):
+	if path is None:
+		return random_draft(hero, rng=rng)
+	with open(path, "r") as f:
+		return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def _agent(path):
+	module, _, name = path.partition(":")
+	return getattr(importlib.import_module(module), name)
+
+
+def main():
+	arguments = ArgumentParser(prog="fireplace.simulate")
+	arguments.add_argument("-n", "--games", type=int, default=100)
+	arguments.add_argument("-j", "--workers", type=int, default=None,
+		help="Number of worker processes (default: number of CPUs)")
+	arguments.add_argument("--seed", type=int, default=0,
+		help="Base seed, also used for drafting missing decks")
+	arguments.add_argument("--hero1", default="MAGE")
+	arguments.add_argument("--hero2", default="WARRIOR")
+	arguments.add_argument("--deck1", help="File with one card ID per line (default: random draft)")
+	arguments.add_argument("--deck2", help="File with one card ID per line (default: random draft)")
+	arguments.add_argument("--agent", default=None, help="Agent callable, as module:function")
+	arguments.add_argument("--max-turns", type=int, default=MAX_TURNS)
+	arguments.add_argument("--profile", action="store_true",
+		help="Time the engine and print a summary of all the games")
+	arguments.add_argument("--profile-json", metavar="PATH",
+		help="Write the profile of all the games to PATH, as JSON")
+	arguments.add_argument("--profile-cards", action="store_true",
+		help="Print the time spent in the scripts of each card over all the games")
+	arguments.add_argument("--trace-dir", metavar="DIR",
+		help="Write a Chrome trace of every game to DIR")
+	args = arguments.parse_args(sys.argv[1:])
+
+	if args.trace_dir:
+		os.makedirs(args.trace_dir, exist_ok=True)
+
+	rng = random.Random(args.seed)
+	hero1, hero2 = _hero(args.hero1), _hero(args.hero2)
+	deck1, deck2 = _deck(args.deck1, hero1, rng), _deck(args.deck2, hero2, rng)
+	agent = _agent(args.agent) if args.agent else random_agent
+
+	wins = [0, 0]
+	draws = errors = 0
+	profiler = Profiler()
+	card_profiler = CardProfiler()
+	profile = args.profile or args.profile_cards or args.profile_json is not None
+	results = simulate(
+		deck1, hero1, deck2, hero2, args.games, agent=agent, seed=args.seed,
+		workers=args.workers, max_turns=args.max_turns, profile=profile,
+		trace_dir=args.trace_dir
+	)
+	for result in results:
+		if result.profile:
+			profiler.merge(result.profile)
+			card_profiler.merge(result.profile)
+			result = result._replace(profile=None)
+		print(json.dumps(result._asdict()))
+		if result.error:
+			errors += 1
+		elif result.winner is None:
+			draws += 1
+		else:
+			wins[result.winner] += 1
+
+	sys.stderr.write("Player1: %i wins, Player2: %i wins, %i draws, %i errors\n" % (
+		wins[0], wins[1], draws, errors
+	))
+	if args.profile:
+		sys.stderr.write(profiler.table(limit=30) + "\n")
+	if args.profile_cards:
+		sys.stderr.write(card_profiler.table(limit=30) + "\n")
+	if args.profile_json:
+		with open(args.profile_json, "w") as f:
+			f.write(profiler.to_json())
+	return 0
+
+
+if __name__ == "__main__":
+	exit(main())
@@ -1,4 +1,5 @@
 import logging
+import random
 
 
 class CardList(list):
@@ -48,11 +49,169 @@ class CardList(list):
 		return self.__class__(e for k, v in kwargs.items() for e in self if getattr(e, k, 0) == v)
 
 
-def random_draft(hero, exclude=[]):
+class IndexedCardList(CardList):
+	"""
+	A CardList keeping an identity index of its items next to the list,
+	so that membership is O(1) and index()/remove() do not scan the list
+	once positions have been looked up. Used for zone containers.
+	Mutations are recorded by the journal of the list's game, if any.
+	"""
+	_journal = None
+
+	def __init__(self, iterable=()):
+		super().__init__(iterable)
+		self._rebuild()
+
+	def _rebuild(self):
+		self._counts = {}
+		for item in self:
+			self._counts[id(item)] = self._counts.get(id(item), 0) + 1
+		self._positions = None
+
+	def _add(self, item):
+		self._counts[id(item)] = self._counts.get(id(item), 0) + 1
+
+	def _discard(self, item):
+		count = self._counts[id(item)] - 1
+		if count:
+			self._counts[id(item)] = count
+		else:
+			del self._counts[id(item)]
+		self._positions = None
+
+	def __contains__(self, x):
+		return id(x) in self._counts
+
+	def __getitem__(self, key):
+		ret = list.__getitem__(self, key)
+		if isinstance(key, slice):
+			# Slices are mostly short-lived copies, skip building an index
+			return CardList(ret)
+		return ret
+
+	def __delitem__(self, key):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		if isinstance(key, slice):
+			items = list.__getitem__(self, key)
+		else:
+			items = (list.__getitem__(self, key), )
+		super().__delitem__(key)
+		for item in items:
+			self._discard(item)
+
+	def __iadd__(self, other):
+		self.extend(other)
+		return self
+
+	def __imul__(self, n):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		super().__imul__(n)
+		self._rebuild()
+		return self
+
+	def __reduce__(self):
+		# The index is keyed by id() and has to be rebuilt for copies
+		state = self.__dict__.copy()
+		del state["_counts"]
+		del state["_positions"]
+		return (self.__class__, (list(self), ), state)
+
+	def __setitem__(self, key, value):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		if isinstance(key, slice):
+			value = list(value)
+			old = list.__getitem__(self, key)
+		else:
+			old = (list.__getitem__(self, key), )
+		super().__setitem__(key, value)
+		for item in old:
+			self._discard(item)
+		for item in (value if isinstance(key, slice) else (value, )):
+			self._add(item)
+
+	def append(self, x):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		super().append(x)
+		self._add(x)
+		if self._positions is not None:
+			self._positions.setdefault(id(x), len(self) - 1)
+
+	def clear(self):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		super().clear()
+		self._rebuild()
+
+	def extend(self, iterable):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		start = len(self)
+		super().extend(iterable)
+		for i in range(start, len(self)):
+			item = list.__getitem__(self, i)
+			self._add(item)
+			if self._positions is not None:
+				self._positions.setdefault(id(item), i)
+
+	def index(self, x):
+		if id(x) not in self._counts:
+			raise ValueError
+		if self._positions is None:
+			positions = {}
+			for i, item in enumerate(self):
+				positions.setdefault(id(item), i)
+			self._positions = positions
+		return self._positions[id(x)]
+
+	def insert(self, i, x):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		super().insert(i, x)
+		self._add(x)
+		self._positions = None
+
+	def pop(self, i=-1):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		ret = super().pop(i)
+		self._discard(ret)
+		return ret
+
+	def remove(self, x):
+		del self[self.index(x)]
+
+	def reverse(self):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		super().reverse()
+		self._positions = None
+
+	def sort(self, *args, **kwargs):
+		journal = self._journal
+		if journal is not None and journal.levels:
+			journal.touch(self)
+		super().sort(*args, **kwargs)
+		self._positions = None
+
+
+def random_draft(hero, exclude=[], rng=random):
 	"""
 	Return a deck of 30 random cards from the \a hero's collection
+	\a rng: The random number generator to draft with, eg. a game's
 	"""
-	import random
 	from . import cards
 	from .deck import Deck
 	from .enums import CardType, Rarity
@@ -61,12 +220,10 @@ def random_draft(hero, exclude=[]):
 	collection = []
 	hero = getattr(cards, hero)
 
-	for card in cards.cardlist:
+	for card in cards.filter(collectible=True):
 		if card in exclude:
 			continue
 		cls = getattr(cards, card)
-		if not cls.collectible:
-			continue
 		if cls.type == CardType.HERO:
 			# Heroes are collectible...
 			continue
@@ -75,7 +232,7 @@ def random_draft(hero, exclude=[]):
 		collection.append(cls)
 
 	while len(deck) < Deck.MAX_CARDS:
-		card = random.choice(collection)
+		card = rng.choice(collection)
 		if card.rarity == Rarity.LEGENDARY and card.id in deck:
 			continue
 		elif deck.count(card.id) < Deck.MAX_UNIQUE_CARDS:
@@ -6,6 +6,7 @@ import socketserver
 import struct
 import sys
 from argparse import ArgumentParser
+from fireplace.entity import Entity
 from fireplace.enums import CardType, GameTag, OptionType, Zone
 from fireplace.game import BaseGame as Game
 from fireplace.player import Player
@@ -26,11 +27,165 @@ class KettleSerializer(json.JSONEncoder):
 			return len(o)
 		return int(o)
 
+	def serialize(self, payloads):
+		return self.encode(payloads).encode("utf-8")
+
+
+# Binary record types, see BinarySerializer
+GAME_ENTITY, PLAYER, FULL_ENTITY, TAG_CHANGE, OPTIONS = range(1, 6)
+RECORD_TYPES = {
+	"GameEntity": GAME_ENTITY,
+	"Player": PLAYER,
+	"FullEntity": FULL_ENTITY,
+	"TagChange": TAG_CHANGE,
+	"Options": OPTIONS,
+}
+# Protocol version, followed by the number of records as a varint
+BINARY_HEADER = struct.Struct("<B")
+BINARY_VERSION = 2
+
+
+def pack_varint(out, value, nullable=False):
+	"""
+	Append \a value to \a out as a varint. Nullable varints reserve 0 for None.
+	"""
+	if nullable:
+		if value is None:
+			out.append(0)
+			return
+		value = int(value)
+	# Zigzag encoding, so that small negative values stay short
+	value = value << 1 if value >= 0 else (-value << 1) - 1
+	if nullable:
+		value += 1
+	while value > 0x7f:
+		out.append(value & 0x7f | 0x80)
+		value >>= 7
+	out.append(value)
+
+
+def unpack_varint(data, pos, nullable=False):
+	value = shift = 0
+	while True:
+		byte = data[pos]
+		pos += 1
+		value |= (byte & 0x7f) << shift
+		if byte < 0x80:
+			break
+		shift += 7
+	if nullable:
+		if not value:
+			return None, pos
+		value -= 1
+	value = value >> 1 if not value & 1 else -((value + 1) >> 1)
+	return value, pos
+
+
+class BinarySerializer:
+	"""
+	Packs payloads into binary records, for clients which asked for the
+	"binary" Encoding in CreateGame. A packet body is a BINARY_HEADER
+	and the record count, followed by the records, each made of its type
+	byte and varints:
+	* GameEntity, Player: entity ID, tag count, (tag, value) pairs
+	* FullEntity: entity ID, card ID length, card ID (UTF-8), tag count,
+	  (tag, value) pairs
+	* TagChange: entity ID, tag, value (nullable)
+	* Options: option count, then for each option its type, entity ID
+	  (0 for none), target count and target IDs
+	See decode_binary() for the reverse.
+	"""
+	def serialize(self, payloads):
+		out = bytearray(BINARY_HEADER.pack(BINARY_VERSION))
+		pack_varint(out, len(payloads))
+		for payload in payloads:
+			type = payload["Type"]
+			out.append(RECORD_TYPES[type])
+			body = payload[type]
+			if type == "TagChange":
+				pack_varint(out, body["EntityID"])
+				pack_varint(out, int(body["Tag"]))
+				pack_varint(out, body["Value"], nullable=True)
+			elif type == "Options":
+				pack_varint(out, len(body))
+				for option in body:
+					pack_varint(out, int(option["Type"]))
+					main = option.get("MainOption", {})
+					pack_varint(out, main.get("ID", 0))
+					targets = main.get("Targets", ())
+					pack_varint(out, len(targets))
+					for target in targets:
+						pack_varint(out, target)
+			else:
+				pack_varint(out, body["EntityID"])
+				if type == "FullEntity":
+					card_id = body["CardID"].encode("utf-8")
+					pack_varint(out, len(card_id))
+					out += card_id
+				tags = body["Tags"]
+				pack_varint(out, len(tags))
+				for tag, value in tags.items():
+					pack_varint(out, int(tag))
+					pack_varint(out, int(value))
+		return bytes(out)
+
+
+def decode_binary(data):
+	"""
+	Decode a packet body packed by BinarySerializer into the payloads the
+	JSON encoding would have sent.
+	"""
+	version, = BINARY_HEADER.unpack_from(data)
+	assert version == BINARY_VERSION
+	names = {v: k for k, v in RECORD_TYPES.items()}
+	count, pos = unpack_varint(data, BINARY_HEADER.size)
+	ret = []
+	for i in range(count):
+		type = names[data[pos]]
+		pos += 1
+		if type == "TagChange":
+			entity_id, pos = unpack_varint(data, pos)
+			tag, pos = unpack_varint(data, pos)
+			value, pos = unpack_varint(data, pos, nullable=True)
+			body = {"EntityID": entity_id, "Tag": tag, "Value": value}
+		elif type == "Options":
+			body = []
+			length, pos = unpack_varint(data, pos)
+			for j in range(length):
+				option_type, pos = unpack_varint(data, pos)
+				entity_id, pos = unpack_varint(data, pos)
+				num_targets, pos = unpack_varint(data, pos)
+				targets = []
+				for k in range(num_targets):
+					target, pos = unpack_varint(data, pos)
+					targets.append(target)
+				option = {"Type": option_type}
+				if entity_id:
+					option["MainOption"] = {"ID": entity_id, "Targets": targets}
+				body.append(option)
+		else:
+			entity_id, pos = unpack_varint(data, pos)
+			body = {"EntityID": entity_id}
+			if type == "FullEntity":
+				length, pos = unpack_varint(data, pos)
+				body["CardID"] = data[pos:pos + length].decode("utf-8")
+				pos += length
+			tags = {}
+			num_tags, pos = unpack_varint(data, pos)
+			for j in range(num_tags):
+				tag, pos = unpack_varint(data, pos)
+				tags[tag], pos = unpack_varint(data, pos)
+			body["Tags"] = tags
+		ret.append({"Type": type, type: body})
+	return ret
+
 
 class KettleManager:
 	def __init__(self, game):
 		self.game = game
 		self.game_state = {}
+		# Entities refreshed on every flush, see is_volatile()
+		self.volatile = set()
 		self.queued_data = []
 
 	def action(self, type, args):
@@ -39,6 +194,9 @@ class KettleManager:
 	def action_end(self, type, args):
 		pass
 
+	def game_step(self, step, next_step):
+		pass
+
 	def add_to_state(self, entity):
 		state = self.game_state[entity.entity_id] = {}
 		for tag, value in entity.tags.items():
@@ -52,13 +210,51 @@ class KettleManager:
 		if zone_pos:
 			state[GameTag.ZONE_POSITION] = zone_pos
 
-		# Don't have a way of getting entities by ID in fireplace yet
-		state[GameTag.ENTITY_ID] = entity
+		state[GameTag.ENTITY_ID] = entity.entity_id
+		if self.is_volatile(entity):
+			self.volatile.add(entity.entity_id)
+
+	def is_volatile(self, entity):
+		"""
+		Whether the tags of \a entity may change without the entity itself
+		being modified, eg. because they depend on other entities or are
+		computed by card scripts.
+		"""
+		if entity.type in (CardType.GAME, CardType.PLAYER, CardType.HERO, CardType.WEAPON):
+			return True
+		if entity.type == CardType.SPELL and entity.data.secret:
+			return True
+		scripts = entity.data.scripts
+		return any(hasattr(scripts, attr) for attr in entity.manager.map.values() if attr)
+
+	def remove_entity(self, entity):
+		if entity.entity_id in self.game_state:
+			# Send the final state of the entity before forgetting about it
+			self.refresh_state(entity.entity_id)
+			del self.game_state[entity.entity_id]
+			self.volatile.discard(entity.entity_id)
+
+	def flush(self):
+		"""
+		Queue the tag changes of the entities modified since the last flush.
+		"""
+		changed = set(self.volatile)
+		for entity in self.game.flush_changes():
+			changed.add(entity.entity_id)
+		for entity_id in self.volatile:
+			entity = self.game.entity(entity_id)
+			if entity.type == CardType.ENCHANTMENT and entity.zone == Zone.PLAY:
+				# Buffs with scripted stats make their owner volatile
+				changed.add(entity.owner.entity_id)
+
+		for entity_id in self.game_state:
+			if entity_id in changed:
+				self.refresh_state(entity_id)
 
 	def refresh_state(self, entity_id):
 		assert entity_id in self.game_state
 		state = self.game_state[entity_id]
-		entity = state[GameTag.ENTITY_ID]
+		entity = self.game.entity(entity_id)
 
 		for tag, value in entity.tags.items():
 			if isinstance(value, str):
@@ -80,10 +276,26 @@ class KettleManager:
 			self.tag_change(entity, GameTag.ZONE_POSITION, zone_pos)
 
 	def refresh_options(self):
-		self.options = [{"Type": OptionType.END_TURN}]
+		self.options = []
+		options = []
+		for option in self.game.current_player.options():
+			if option.type == OptionType.END_TURN:
+				options.append({"Type": OptionType.END_TURN})
+			elif isinstance(option.entity, Entity):
+				options.append({
+					"Type": option.type,
+					"MainOption": {
+						"ID": option.entity.entity_id,
+						"Targets": [target.entity_id for target in option.targets],
+					},
+				})
+			else:
+				# Kettle skips the mulligan, choices are not offered
+				continue
+			self.options.append(option)
 		payload = {
 			"Type": "Options",
-			"Options": self.options,
+			"Options": options,
 		}
 		self.queued_data.append(payload)
 
@@ -110,10 +322,21 @@ class KettleManager:
 
 	def process_send_option(self, data):
 		option = self.options[data["Index"]]
-		if option["Type"] == OptionType.END_TURN:
+		if option.type == OptionType.END_TURN:
 			self.game.end_turn()
+			return
+
+		entity = option.entity
+		target = None
+		if option.targets:
+			target = self.game.entity(data["Target"])
+			assert target in option.targets
+		if entity.zone == Zone.HAND:
+			entity.play(target=target)
+		elif entity.type == CardType.HERO_POWER:
+			entity.use(target=target)
 		else:
-			raise NotImplementedError
+			entity.attack(target)
 
 	def tag_change(self, entity, tag, value):
 		payload = {
@@ -155,83 +378,163 @@ class KettleManager:
 		}
 
 
-class Kettle(socketserver.BaseRequestHandler):
-	def handle(self):
-		data = self.read_packet()
+class KettleSession:
+	"""
+	A Kettle game, independent from the connection it is played over.
+	Takes decoded packets and returns the framed responses to send back.
+	"""
+	def __init__(self):
+		self.serializer = KettleSerializer()
+		self.manager = None
+
+	def create_game(self, data):
 		data = data[0]
 		query_type = data["Type"]
 		payload = data[query_type]
 		DEBUG("Got payload %r", payload)
 		assert query_type == "CreateGame"
 
-		self.serializer = KettleSerializer()
-		manager = self.create_game(payload)
-
-		while True:
-			for entity in manager.game_state:
-				manager.refresh_state(entity)
-			manager.refresh_options()
-			self.send_payload(manager)
-			packet = self.read_packet()
-			if packet is None:
-				break
-
-			if packet["Type"] == "SendOption":
-				manager.process_send_option(packet["SendOption"])
-			else:
-				raise NotImplementedError
+		encoding = payload.get("Encoding", "json")
+		if encoding == "binary":
+			self.serializer = BinarySerializer()
+		elif encoding != "json":
+			raise ValueError("Unknown encoding %r" % (encoding))
 
-			self.send_payload(manager)
+		self.manager = create_game(payload)
+		return [self.refresh()]
 
-	def read_packet(self):
-		header = self.request.recv(4)
-		if not header:
-			return None
-		body_size, = struct.unpack("<i", header)
-		data = self.request.recv(body_size)
-		DEBUG("Got data %r", data)
-		return json.loads(data.decode("utf-8"))
+	def process(self, packet):
+		if packet["Type"] == "SendOption":
+			self.manager.process_send_option(packet["SendOption"])
+		else:
+			raise NotImplementedError
 
-	def send_payload(self, manager):
-		serialized = self.serializer.encode(manager.queued_data).encode("utf-8")
+		return [self.encode_payload(), self.refresh()]
+
+	def error(self, message):
+		"""
+		Returns the framed payload reporting \a message to the client. It is
+		always JSON encoded, as the client may not support the encoding it
+		asked for.
+		"""
+		payload = [{"Type": "Error", "Error": {"Message": message}}]
+		serialized = KettleSerializer().serialize(payload)
+		return struct.pack("<i", len(serialized)) + serialized
+
+	def close(self):
+		if self.manager is not None:
+			self.manager.game.untrack_changes()
+			self.manager = None
+
+	def refresh(self):
+		manager = self.manager
+		manager.flush()
+		manager.refresh_options()
+		return self.encode_payload()
+
+	def encode_payload(self):
+		manager = self.manager
+		serialized = self.serializer.serialize(manager.queued_data)
 		manager.queued_data = []
 		response_payload = struct.pack("<i", len(serialized)) + serialized
 		DEBUG("Sending %r" % (response_payload))
-		self.request.sendall(response_payload)
-
-	def create_game(self, payload):
-		# self.game_id = payload["GameID"]
-		player_data = payload["Players"]
-		players = []
-		for player in player_data:
-			p = Player(player["Name"])
-			# Shuffle the cards to prevent information leaking
-			cards = player["Cards"]
-			random.shuffle(cards)
-			p.prepare_deck(cards, player["Hero"])
-			players.append(p)
-
-		INFO("Initializing a Kettle game with players=%r", players)
-		game = Game(players=players)
-		manager = KettleManager(game)
-		game.manager.register(manager)
-		game.current_player = game.players[0]  # Dumb.
-		game.start()
-
-		# Skip mulligan
-		for player in game.players:
-			player.choice = None
-
-		return manager
+		return response_payload
+
+
+def decode_packet(data):
+	DEBUG("Got data %r", data)
+	return json.loads(data.decode("utf-8"))
+
+
+def create_game(payload):
+	# game_id = payload["GameID"]
+	# Each game draws from its own generator, seeded by the optional
+	# "Seed" of the payload, as games may run on several threads
+	rng = random.Random(payload.get("Seed"))
+	player_data = payload["Players"]
+	players = []
+	for player in player_data:
+		p = Player(player["Name"])
+		# Shuffle the cards to prevent information leaking
+		cards = player["Cards"]
+		rng.shuffle(cards)
+		p.prepare_deck(cards, player["Hero"])
+		players.append(p)
+
+	INFO("Initializing a Kettle game with players=%r", players)
+	game = Game(players=players, seed=rng.getrandbits(64))
+	manager = KettleManager(game)
+	game.manager.register(manager)
+	game.track_changes()
+	game.current_player = game.players[0]  # Dumb.
+	game.start()
+
+	# Skip mulligan
+	for player in game.players:
+		player.choice = None
+
+	return manager
+
+
+class Kettle(socketserver.BaseRequestHandler):
+	def handle(self):
+		session = KettleSession()
+		try:
+			try:
+				responses = session.create_game(self.read_packet())
+			except ValueError as e:
+				WARN("Cannot create the game: %s", e)
+				self.request.sendall(session.error(str(e)))
+				return
+
+			while True:
+				for response in responses:
+					self.request.sendall(response)
+				packet = self.read_packet()
+				if packet is None:
+					break
+				responses = session.process(packet)
+		finally:
+			session.close()
+
+	def recv(self, size):
+		data = b""
+		while len(data) < size:
+			chunk = self.request.recv(size - len(data))
+			if not chunk:
+				return None
+			data += chunk
+		return data
+
+	def read_packet(self):
+		header = self.recv(4)
+		if not header:
+			return None
+		body_size, = struct.unpack("<i", header)
+		data = self.recv(body_size)
+		if data is None:
+			return None
+		return decode_packet(data)
 
 
 def main():
 	arguments = ArgumentParser(prog="kettle")
 	arguments.add_argument("hostname", default="127.0.0.1", nargs="?")
 	arguments.add_argument("port", type=int, default=9111, nargs="?")
+	arguments.add_argument("--asyncio", action="store_true",
+		help="Serve concurrent games from an asyncio event loop")
 	args = arguments.parse_args(sys.argv[1:])
 
+	if args.asyncio and sys.version_info < (3, 7):
+		arguments.error("--asyncio requires Python 3.7 or later")
+
 	INFO("Listening on %s:%i..." % (args.hostname, args.port))
+	if args.asyncio:
+		# Only imported on request, it cannot be parsed by older versions
+		from kettle_asyncio import run
+		run(args.hostname, args.port)
+		return 0
+
 	socketserver.TCPServer.allow_reuse_address = True
 	kettle = socketserver.TCPServer((args.hostname, args.port), Kettle)
 	kettle.serve_forever()
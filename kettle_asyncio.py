@@ -0,0 +1,64 @@
+"""
+Kettle server serving concurrent games from an asyncio event loop, see
+kettle.py --asyncio. Requires Python 3.7 or later.
+"""
+import asyncio
+import struct
+from kettle import KettleLogger, KettleSession, WARN, decode_packet
+
+
+async def read_packet(reader):
+	try:
+		header = await reader.readexactly(4)
+		body_size, = struct.unpack("<i", header)
+		data = await reader.readexactly(body_size)
+	except asyncio.IncompleteReadError:
+		return None
+	return decode_packet(data)
+
+
+async def handle_connection(reader, writer):
+	"""
+	Plays a game over an asyncio connection. The game logic runs on the
+	loop's default executor, so the event loop keeps serving the other
+	clients meanwhile. Games only wait on their own client.
+	"""
+	loop = asyncio.get_running_loop()
+	session = KettleSession()
+	try:
+		packet = await read_packet(reader)
+		if packet is None:
+			return
+		try:
+			responses = await loop.run_in_executor(None, session.create_game, packet)
+		except ValueError as e:
+			WARN("Cannot create the game: %s", e)
+			writer.write(session.error(str(e)))
+			await writer.drain()
+			return
+
+		while True:
+			for response in responses:
+				writer.write(response)
+			await writer.drain()
+			packet = await read_packet(reader)
+			if packet is None:
+				break
+			responses = await loop.run_in_executor(None, session.process, packet)
+	except ConnectionError as e:
+		WARN("Connection lost: %r", e)
+	except Exception:
+		KettleLogger.exception("Game aborted")
+	finally:
+		session.close()
+		writer.close()
+
+
+async def serve(hostname, port):
+	server = await asyncio.start_server(handle_connection, hostname, port, reuse_address=True)
+	async with server:
+		await server.serve_forever()
+
+
+def run(hostname, port):
+	asyncio.run(serve(hostname, port))
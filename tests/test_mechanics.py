@@ -1,5 +1,20 @@
+import importlib
+import json
+import logging
+import os
+import random
+import struct
+import sys
+import tempfile
 from utils import *
-from fireplace.cards.utils import Give, JOUST
+from fireplace import cardxml
+from fireplace.actions import EventListener, resolve
+from fireplace.cards.utils import CONTROLLER, MINION, SELF, Damage, Give, Summon, JOUST
+from fireplace.entity import Entity
+from fireplace.game import GameOver
+from fireplace.profiling import CardProfiler, ChromeTrace, Profiler
+from fireplace.simulate import play_game, simulate
+from fireplace.utils import IndexedCardList
 
 
 def test_armor():
@@ -23,6 +38,32 @@ def test_armor():
 	assert game.current_player.opponent.hero.armor == 0
 
 
+def test_aura_refresh():
+	game = prepare_game()
+	wisp = game.player1.give(WISP)
+	wisp.play()
+	raidleader = game.player1.give("CS2_122")
+	raidleader.play()
+	aura = raidleader.auras[0]
+	assert aura.incremental
+	assert wisp.atk == 1 + 1
+	buff = wisp.buffs[0]
+
+	# Actions which do not move entities around leave the aura alone
+	selector = aura.selector
+	aura.selector = None
+	game.queue_actions(game.player1, [Damage(game.player2.hero, 1)])
+	assert wisp.buffs == [buff]
+	assert aura._entity_buff(wisp) is buff
+	aura.selector = selector
+
+	# Silenced targets get buffed again
+	game.player1.give(SILENCE).play(target=wisp)
+	assert wisp.atk == 1 + 1
+	assert wisp.buffs[0] is not buff
+	assert aura._entity_buff(wisp) is wisp.buffs[0]
+
+
 def test_auras():
 	game = prepare_game()
 	wisp1 = game.current_player.give(WISP)
@@ -118,6 +159,81 @@ def test_card_draw():
 	assert len(game.current_player.hand) == handlength - 2
 
 
+def test_card_db_cache():
+	xml = '<CardDefs><Entity CardID="TEST_001"><Tag enumID="48" value="%i"/></Entity></CardDefs>'
+	with tempfile.TemporaryDirectory() as path:
+		xmlfile = os.path.join(path, "CardDefs.xml")
+		with open(xmlfile, "w") as f:
+			f.write(xml % (3))
+		db = cardxml.load_cached(xmlfile)
+		assert db["TEST_001"].cost == 3
+		assert os.path.exists(xmlfile + ".cache")
+		db = cardxml.load_cached(xmlfile)
+		assert db["TEST_001"].xml is None
+		assert db["TEST_001"].id == "TEST_001"
+		assert db["TEST_001"].cost == 3
+
+		# Stale caches are rebuilt
+		with open(xmlfile, "w") as f:
+			f.write(xml % (5))
+		assert cardxml.load_cached(xmlfile)["TEST_001"].cost == 5
+		assert cardxml.load_cached(xmlfile)["TEST_001"].cost == 5
+
+
+def test_card_lookup():
+	raidleader = getattr(fireplace.cards, "CS2_122")
+	assert raidleader.id == "CS2_122"
+	assert hasattr(raidleader.scripts, "aura")
+	assert getattr(fireplace.cards, "CS2_122") is raidleader
+	assert getattr(fireplace.cards, WISP).scripts
+	assert not hasattr(fireplace.cards, "NOT_A_CARD")
+
+
+def test_card_definitions():
+	# The index of the definitions matches the card sets once imported, the
+	# last set defining a card winning
+	expected = {}
+	for package in fireplace.cards.CARD_SETS:
+		module = importlib.import_module("fireplace.cards." + package)
+		for id in fireplace.cards.db:
+			if hasattr(module, id):
+				expected[id] = getattr(module, id)
+	for id in fireplace.cards.db:
+		assert fireplace.cards._definition(id) is expected.get(id), id
+
+
+def test_card_filter():
+	minions = fireplace.cards.filter(collectible=True, type=CardType.MINION, cost=3, race=None)
+	assert minions
+	assert minions == tuple(
+		id for id in fireplace.cards.cardlist if fireplace.cards.db[id].collectible and
+		fireplace.cards.db[id].type == CardType.MINION and fireplace.cards.db[id].cost == 3
+	)
+	# Results are memoized, without copies
+	assert fireplace.cards.filter(cost=3, type=CardType.MINION, collectible=True) is minions
+	assert fireplace.cards.filter(collectible=True, secret=True, card_class=CardClass.MAGE)
+
+
+def test_card_profiler():
+	game = prepare_game()
+	profiler = CardProfiler()
+	game.manager.register(profiler)
+	# Frothing Berserker
+	berserker = game.player1.give("EX1_604")
+	berserker.play()
+	game.player1.give(MOONFIRE).play(target=berserker)
+	assert all(category.startswith("script:") for category, name in profiler.stats)
+	cards = {card["id"]: card for card in profiler.cards()}
+	assert "event" in cards["EX1_604"]["hooks"]
+	assert "play" in cards[MOONFIRE]["hooks"]
+	assert "Frothing Berserker" in profiler.table()
+
+	total = CardProfiler()
+	total.merge(Profiler())
+	total.merge(profiler.rows())
+	assert total.cards()[0]["calls"] > 0
+
+
 def test_cant_draw():
 	game = prepare_game()
 	game.player1.discard_hand()
@@ -171,6 +287,174 @@ def test_charge():
 	assert watcher.can_attack()
 
 
+def test_checkpoint():
+	game = prepare_game()
+	raidleader = game.player1.give("CS2_122")
+	raidleader.play()
+	wisp = game.player1.give(WISP)
+	wisp.play()
+	hand = game.player1.hand[:]
+	counter = game.manager.counter
+	checkpoint = game.checkpoint()
+
+	soulfire = game.player1.give(SOULFIRE)
+	soulfire_id = soulfire.entity_id
+	soulfire.play(target=raidleader)
+	assert raidleader.dead
+	assert wisp.atk == 1
+	wisp2 = game.player1.give(WISP)
+	nested = game.checkpoint()
+	wisp2.play()
+	game.rollback(nested)
+	assert wisp2.zone == Zone.HAND
+	game.end_turn()
+	assert game.current_player is game.player2
+
+	game.rollback(checkpoint)
+	assert game.current_player is game.player1
+	assert game.manager.counter == counter
+	assert soulfire_id not in game.entities_by_id
+	assert game.player1.hand == hand
+	assert raidleader.zone == Zone.PLAY
+	assert raidleader.health == 2
+	assert wisp.atk == 2
+	assert game.player1.field == [raidleader, wisp]
+
+	# The game keeps working, and entity IDs are handed out again
+	wisp3 = game.player1.give(WISP)
+	assert wisp3.entity_id == soulfire_id
+	wisp3.play()
+	assert wisp3.atk == 2
+	checkpoint = game.checkpoint()
+	wisp3.destroy()
+	game.commit(checkpoint)
+	assert wisp3.dead
+	assert wisp.atk == 2
+
+
+def test_checkpoint_clone():
+	game = prepare_game()
+	wisp = game.player1.give(WISP)
+	checkpoint = game.checkpoint()
+	wisp.play()
+	clone = game.clone()
+	clone_wisp = clone.player1.field[0]
+	game.rollback(checkpoint)
+	assert wisp.zone == Zone.HAND
+
+	# The clone was created after the checkpoint, rolling back leaves it alone
+	assert clone_wisp.zone == Zone.PLAY
+	assert clone_wisp.atk == 1
+	assert clone.player1.field == [clone_wisp]
+	clone.player1.give("CS2_122").play()
+	assert clone_wisp.atk == 2
+
+
+def test_checkpoint_other_game():
+	game1 = prepare_game()
+	game2 = prepare_game()
+	wisp1 = game1.player1.give(WISP)
+	wisp2 = game2.player1.give(WISP)
+	checkpoint = game1.checkpoint()
+	wisp1.play()
+	wisp2.play()
+	game2.player1.give(MOONFIRE).play(target=game2.player2.hero)
+	game1.rollback(checkpoint)
+
+	assert wisp1.zone == Zone.HAND
+	assert wisp2.zone == Zone.PLAY
+	assert game2.player1.field == [wisp2]
+	assert game2.player2.hero.health == 29
+
+	# Both games can be journaled at once
+	checkpoint1 = game1.checkpoint()
+	checkpoint2 = game2.checkpoint()
+	wisp1.play()
+	wisp2.destroy()
+	game1.rollback(checkpoint1)
+	assert wisp1.zone == Zone.HAND
+	assert wisp2.dead
+	game2.rollback(checkpoint2)
+	assert wisp2.zone == Zone.PLAY
+	assert game2.player1.field == [wisp2]
+
+
+def test_chrome_trace():
+	game = prepare_game()
+	with tempfile.TemporaryDirectory() as path:
+		tracefile = os.path.join(path, "trace.json")
+		with ChromeTrace(tracefile, categories=("action", )) as trace:
+			game.manager.register(trace)
+			wisp = game.player1.give(WISP)
+			wisp.play()
+			moonfire = game.player1.give(MOONFIRE)
+			moonfire.play(target=wisp)
+		with open(tracefile, "r") as f:
+			events = json.load(f)
+
+	assert {event["cat"] for event in events if event["ph"] in "BE"} == {"action"}
+	stack = []
+	for event in events:
+		if event["ph"] == "B":
+			stack.append(event["name"])
+		elif event["ph"] == "E":
+			assert stack.pop() == event["name"]
+	assert not stack
+	hits = [event for event in events if event["ph"] == "B" and event["name"] == "Hit"]
+	assert hits[0]["args"]["source"] == repr(moonfire)
+	assert hits[0]["args"]["targets"] == [repr(wisp)]
+
+	rng = random.Random(0)
+	result = play_game(random_draft(MAGE, rng=rng), MAGE, random_draft(MAGE, rng=rng), MAGE, 1, trace=os.devnull)
+	assert not result.error
+
+	# Scripts interrupted by the end of the game are closed
+	game = prepare_game()
+	with open(os.devnull, "w") as f, ChromeTrace(f, categories=("script:play", )) as trace:
+		game.manager.register(trace)
+		game.player2.hero.damage = 29
+		try:
+			game.player1.give(MOONFIRE).play(target=game.player2.hero)
+		except GameOver:
+			pass
+		assert game.player2.hero.dead
+		assert not trace._stack
+
+
+def test_clone():
+	game = prepare_game()
+	raidleader = game.player1.give("CS2_122")
+	raidleader.play()
+	wisp = game.player1.give(WISP)
+	wisp.play()
+	assert wisp.atk == 2
+	observer = object()
+	game.manager.register(observer)
+	clone = game.clone()
+	game.manager.observers.remove(observer)
+	assert clone is not game
+	assert not clone.manager.observers
+	assert clone.turn == game.turn
+	assert clone.current_player is clone.player1
+	assert clone.player1.opponent is clone.player2
+	wisp2 = clone.entity(wisp.entity_id)
+	assert wisp2 is not wisp
+	assert wisp2.controller is clone.player1
+	assert wisp2.atk == 2
+	assert wisp2 in clone.player1.field
+	assert wisp not in clone.player1.field
+
+	# Both games are fully independent
+	clone.player1.give(SOULFIRE).play(target=clone.entity(raidleader.entity_id))
+	assert wisp2.atk == 1
+	assert wisp.atk == 2
+	assert raidleader.zone == Zone.PLAY
+	wisp3 = clone.player1.give(WISP)
+	assert wisp3.entity_id not in game.entities_by_id
+	game.end_turn()
+	assert clone.current_player is clone.player1
+
+
 def test_combo():
 	game = prepare_game()
 	game.end_turn(); game.end_turn()
@@ -256,6 +540,64 @@ def test_divine_shield():
 	assert gurubashi.health == 7
 
 
+def test_entity_ids():
+	game = prepare_game()
+	assert game.entity(game.entity_id) is game
+	assert game.entity(game.player1.entity_id) is game.player1
+	wisp = game.player1.give(WISP)
+	wisp.play()
+	assert game.entity(wisp.entity_id) is wisp
+	game.player1.give("CS2_087").play(target=wisp)
+	buff = wisp.buffs[0]
+	assert game.entity(buff.entity_id) is buff
+	wisp.silence()
+	assert buff.entity_id not in game.entities_by_id
+	assert game.entity(wisp.entity_id) is wisp
+
+
+def test_event_listeners():
+	game = prepare_game()
+	juggler1 = game.player1.give("NEW1_019")
+	juggler1.play()
+	juggler2 = game.player1.give("NEW1_019")
+	assert game.get_listeners(Summon, EventListener.AFTER) == [juggler1]
+	assert game.get_listeners(Summon, EventListener.AFTER, hands=True) == []
+	juggler2.play()
+	listeners = game.get_listeners(Summon, EventListener.AFTER)
+	assert len(listeners) == 2
+	assert listeners[0] is juggler1
+	assert listeners[1] is juggler2
+	juggler1.silence()
+	listeners = game.get_listeners(Summon, EventListener.AFTER)
+	assert len(listeners) == 1
+	assert listeners[0] is juggler2
+	juggler2.destroy()
+	assert not game.get_listeners(Summon, EventListener.AFTER)
+
+	cobra = game.player1.give("EX1_170")
+	assert not game.get_listeners(Damage, EventListener.ON)
+	cobra.play()
+	assert game.get_listeners(Damage, EventListener.ON) == [cobra]
+	cobra.silence()
+	assert not game.get_listeners(Damage, EventListener.ON)
+
+
+def test_event_listeners_order():
+	game = prepare_game(WARRIOR, WARRIOR)
+	hero = game.player1.hero
+	game.player1.give("CS2_106").play()
+	game.player1.give(WISP).play()
+	hero.buff(hero, "CS2_005o")
+	game.player1.field[0].buff(game.player1.field[0], "CS2_005o")
+	assert hero.buffs and game.player1.weapon
+
+	# Listeners are sorted like the entities of the game, whatever the
+	# order they registered in
+	entities = list(game.entities)
+	game._listeners["test", None] = IndexedCardList(reversed(entities))
+	assert game.get_listeners("test", None) == entities
+
+
 def test_freeze():
 	game = prepare_game()
 	flameimp = game.current_player.give("EX1_319")
@@ -335,6 +677,56 @@ def test_graveyard_secrets():
 	assert wisp in game.graveyard
 
 
+def test_headless():
+	game = prepare_game()
+	records = []
+	handler = logging.Handler()
+	handler.emit = records.append
+	logger.addHandler(handler)
+	try:
+		game.player1.give(WISP).play()
+		assert records
+		del records[:]
+		game.headless = True
+		wisp = game.player1.give(WISP)
+		wisp.play()
+		game.player1.give(MOONFIRE).play(target=wisp)
+		game.end_turn()
+		assert not records
+		assert wisp.dead
+	finally:
+		logger.removeHandler(handler)
+
+
+def test_indexed_cardlist():
+	game = prepare_game()
+	wisp1 = game.player1.give(WISP)
+	wisp2 = game.player1.give(WISP)
+	hand = game.player1.hand
+	assert isinstance(hand, IndexedCardList)
+	assert wisp1 in hand
+	assert hand.index(wisp2) == len(hand) - 1
+	wisp1.play()
+	assert wisp1 not in hand
+	assert wisp1 in game.player1.field
+	assert hand.index(wisp2) == len(hand) - 1
+	assert wisp2 in hand[:]
+	assert not isinstance(hand[:], IndexedCardList)
+
+	cards = IndexedCardList([wisp1, wisp2, wisp1])
+	cards.remove(wisp1)
+	assert cards == [wisp2, wisp1]
+	assert cards.index(wisp1) == 1
+	cards[0] = wisp1
+	assert wisp2 not in cards
+	assert cards.index(wisp1) == 0
+	cards += [wisp2]
+	assert cards.index(wisp2) == 2
+	del cards[:2]
+	assert wisp1 not in cards
+	assert cards.index(wisp2) == 0
+
+
 def test_joust():
 	game = prepare_empty_game()
 	wisp = game.player1.give(WISP)
@@ -353,6 +745,73 @@ def test_joust():
 	assert not game.player1.hand.filter(id=TARGET_DUMMY)
 
 
+def test_kettle_binary():
+	from kettle import BinarySerializer, KettleSerializer, decode_binary
+
+	payloads = [
+		{"Type": "FullEntity", "FullEntity": {
+			"EntityID": 4, "CardID": WISP, "Tags": {GameTag.ZONE: Zone.HAND, GameTag.COST: 0},
+		}},
+		{"Type": "TagChange", "TagChange": {"EntityID": 4, "Tag": GameTag.ZONE_POSITION, "Value": None}},
+		{"Type": "TagChange", "TagChange": {"EntityID": 4, "Tag": GameTag.ATK, "Value": 0}},
+		{"Type": "TagChange", "TagChange": {"EntityID": 4, "Tag": GameTag.ATK, "Value": -1}},
+		{"Type": "TagChange", "TagChange": {"EntityID": 4, "Tag": GameTag.ATK, "Value": 300}},
+		{"Type": "Options", "Options": [
+			{"Type": 2},
+			{"Type": 3, "MainOption": {"ID": 4, "Targets": [1, 2]}},
+		]},
+	]
+	# More records than a 16-bit count would allow
+	payloads += [payloads[1]] * 70000
+	expected = json.loads(KettleSerializer().serialize(payloads).decode("utf-8"))
+	for payload in expected:
+		if "Tags" in payload.get("FullEntity", {}):
+			tags = payload["FullEntity"]["Tags"]
+			payload["FullEntity"]["Tags"] = {int(tag): value for tag, value in tags.items()}
+	assert decode_binary(BinarySerializer().serialize(payloads)) == expected
+
+
+def test_kettle_encoding():
+	from kettle import KettleSession
+
+	session = KettleSession()
+	packet = {"Type": "CreateGame", "CreateGame": {"Encoding": "xml", "Players": []}}
+	try:
+		session.create_game([packet])
+		assert False, "Unknown encodings are refused"
+	except ValueError:
+		pass
+	assert session.manager is None
+
+	# Errors are reported to the client as JSON
+	response = session.error("Unknown encoding 'xml'")
+	size, = struct.unpack("<i", response[:4])
+	assert size == len(response) - 4
+	assert json.loads(response[4:].decode("utf-8")) == [
+		{"Type": "Error", "Error": {"Message": "Unknown encoding 'xml'"}}
+	]
+
+
+def test_kettle_seed():
+	from kettle import create_game
+
+	def payload():
+		cards = [WISP] * 15 + [MOONFIRE] * 15
+		return {"Seed": 42, "Players": [
+			{"Name": "Player1", "Hero": MAGE, "Cards": cards[:]},
+			{"Name": "Player2", "Hero": MAGE, "Cards": cards[:]},
+		]}
+
+	# The seed of the payload draws the decks and the game alike
+	games = [create_game(payload()).game for i in range(2)]
+	assert games[0].seed == games[1].seed
+	for player1, player2 in zip(games[0].players, games[1].players):
+		assert [card.id for card in player1.hand] == [card.id for card in player2.hand]
+		assert [card.id for card in player1.deck] == [card.id for card in player2.deck]
+	for game in games:
+		game.untrack_changes()
+
+
 def test_mana():
 	game = prepare_game(game_class=Game)
 	footman = game.player1.give(GOLDSHIRE_FOOTMAN)
@@ -416,6 +875,61 @@ def test_morph():
 	assert len(game.current_player.opponent.hand) == 1
 
 
+def test_options():
+	game = prepare_empty_game(MAGE, MAGE)
+	wisp = game.player1.give(WISP)
+	moonfire = game.player1.give(MOONFIRE)
+	options = game.player1.options()
+	entities = [option.entity for option in options]
+	assert wisp in entities
+	assert moonfire in entities
+	assert game.player1.hero.power in entities
+	assert options[-1].type == OptionType.END_TURN
+	for option in options:
+		if option.entity is moonfire:
+			assert option.targets == moonfire.targets
+		elif option.entity is wisp:
+			assert option.targets == []
+	# Cached until the game changes
+	assert game.player1.options()[0] is options[0]
+	assert game.player2.options() == []
+
+	wisp.play()
+	entities = [option.entity for option in game.player1.options()]
+	assert wisp not in entities
+	assert moonfire in entities
+	game.end_turn()
+	assert game.player1.options() == []
+	assert game.player2.options()[-1].type == OptionType.END_TURN
+
+	# Tags set outside of actions are taken into account
+	game.end_turn()
+	assert wisp in [option.entity for option in game.player1.options()]
+	wisp.frozen = True
+	assert wisp not in [option.entity for option in game.player1.options()]
+	game.player1.hero.power.use(target=game.player2.hero)
+	assert game.player1.hero.power not in [option.entity for option in game.player1.options()]
+
+
+def test_options_choice():
+	player1 = Player("Player1")
+	player1.prepare_deck([WISP] * 30, MAGE)
+	player2 = Player("Player2")
+	player2.prepare_deck([WISP] * 30, MAGE)
+	game = Game(players=(player1, player2))
+	game.start()
+
+	# The mulligan is offered as a single POWER option
+	options = game.player1.options()
+	assert len(options) == 1
+	assert options[0].type == OptionType.POWER
+	assert options[0].entity is game.player1.choice
+	assert options[0].targets == game.player1.choice.cards
+	game.player1.choice.choose()
+	game.player2.choice.choose()
+	assert game.player1.options()[-1].type == OptionType.END_TURN
+
+
 def test_overload():
 	game = prepare_game(game_class=Game)
 	dustdevil = game.player1.give("EX1_243")
@@ -487,6 +1001,130 @@ def test_positioning():
 	assert wisp4.atk == 3, wisp4.atk
 
 
+def test_profiler():
+	game = prepare_game()
+	profiler = Profiler()
+	game.manager.register(profiler)
+	wisp = game.player1.give(WISP)
+	wisp.play()
+	game.player1.give(MOONFIRE).play(target=wisp)
+	# Arcane Explosion
+	game.player1.give("CS2_025").play()
+	stats = {(row["category"], row["name"]): row for row in profiler.rows()}
+	assert stats["action", "Play"]["calls"] == 3
+	assert stats["action", "Play"]["max_depth"] == 1
+	assert stats["action", "Hit"]["max_depth"] > 1
+	assert stats["action", "Play"]["cumulative"] >= stats["action", "Play"]["self"]
+	assert ("deaths", "process_deaths") in stats
+	assert ("aura", "refresh_auras") in stats
+	assert any(category == "selector" for category, name in stats)
+
+	total = Profiler()
+	total.merge(profiler)
+	total.merge(profiler.rows())
+	assert total.stats["action", "Play"][0] == 6
+	assert "Play" in total.table()
+
+	result = play_game(random_draft(hero=MAGE), MAGE, random_draft(hero=MAGE), MAGE, 1, profile=True)
+	assert result.profile
+
+
+def test_random_seed():
+	deck = random_draft(hero=MAGE)
+
+	def new_game():
+		players = (Player("Player1"), Player("Player2"))
+		for player in players:
+			player.prepare_deck(deck, MAGE)
+		game = Game(players=players, seed=1234)
+		game.start()
+		return game
+
+	game1 = new_game()
+	game2 = new_game()
+	assert game1.seed == game2.seed == 1234
+	assert game1.player1.name == game2.player1.name
+	for player1, player2 in zip(game1.players, game2.players):
+		assert [card.id for card in player1.deck] == [card.id for card in player2.deck]
+		assert [card.id for card in player1.hand] == [card.id for card in player2.hand]
+
+	# Clones carry on with the same random draws
+	clone = game1.clone()
+	assert clone.random is not game1.random
+	assert clone.random.random() == game1.random.random()
+
+	# Drafts use the given random number generator only
+	state = random.getstate()
+	assert random_draft(MAGE, rng=game1.random) == random_draft(MAGE, rng=clone.random)
+	assert random.getstate() == state
+
+
+def test_resolve():
+	def nested(depth):
+		if depth:
+			return (yield nested(depth - 1)) + 1
+		return 0
+
+	depth = sys.getrecursionlimit() * 2
+	assert resolve(nested(depth)) == depth
+
+	def failing():
+		yield
+		raise ValueError()
+
+	def catching():
+		try:
+			yield failing()
+		except ValueError:
+			return "caught"
+
+	assert resolve(catching()) == "caught"
+
+
+def test_resolve_event_chain():
+	game = prepare_game()
+	depths = []
+
+	def summon_wisp(self, *args):
+		frame, depth = sys._getframe(), 0
+		while frame:
+			frame, depth = frame.f_back, depth + 1
+		depths.append(depth)
+		return [Summon(CONTROLLER, WISP)]
+
+	wisp = game.player1.give(WISP)
+	wisp.play()
+	wisp._events.append(Summon(CONTROLLER, MINION - SELF).after(summon_wisp))
+	game.refresh_listeners(wisp)
+	game.player1.summon(WISP)
+	assert len(game.player1.field) == 7
+	# Every summon triggers the next one, without nesting Python calls
+	assert len(set(depths)) == 1
+
+
+def test_shared_card_data():
+	game = prepare_game()
+	wisp1 = game.player1.give(WISP)
+	wisp2 = game.player1.give(WISP)
+	assert wisp1.requirements is wisp2.requirements
+	assert wisp1.uuid != wisp2.uuid
+	assert wisp1.uuid == wisp1.uuid
+
+	# Copy on write
+	wisp1.requirements = {PlayReq.REQ_TARGET_TO_PLAY: 0}
+	assert wisp1.requirements != wisp2.requirements
+	assert not wisp2.requirements
+
+	Entity.sequential_uuids = True
+	try:
+		# Numbered on first use
+		uuid1 = game.player1.give(WISP).uuid
+		uuid2 = game.player1.give(WISP).uuid
+		assert uuid2.int == uuid1.int + 1
+	finally:
+		Entity.sequential_uuids = False
+
+
 def test_silence():
 	game = prepare_game()
 	silence = game.current_player.give(SILENCE)
@@ -511,6 +1149,25 @@ def test_silence_deathrattle():
 	assert len(game.player1.field) == 0
 
 
+def test_simulate():
+	rng = random.Random(0)
+	deck1 = random_draft(MAGE, rng=rng)
+	deck2 = random_draft(WARRIOR, rng=rng)
+	results = list(simulate(deck1, MAGE, deck2, WARRIOR, 3, seed=10, workers=1))
+	assert [result.seed for result in results] == [10, 11, 12]
+	for result in results:
+		assert result.error is None
+		assert result.turns
+		assert len(result.players) == 2
+		assert result.players[0]["hero"] == MAGE
+		# Games replay identically from their seed
+		assert play_game(deck1, MAGE, deck2, WARRIOR, result.seed) == result
+
+	# Worker processes play the same games
+	pooled = simulate(deck1, MAGE, deck2, WARRIOR, 3, seed=10, workers=2)
+	assert sorted(pooled, key=lambda result: result.seed) == results
+
+
 def test_spell_power():
 	game = prepare_game(HUNTER, HUNTER)
 
@@ -555,6 +1212,35 @@ def test_spell_power():
 	assert game.player2.hero.health == expected_health
 
 
+def test_stat_cache():
+	game = prepare_game()
+	amani = game.player1.give("EX1_393")
+	amani.play()
+	assert amani.atk == 2
+	assert "atk" in amani._stat_cache
+	game.player1.give("CS2_087").play(target=amani)
+	assert amani.atk == 2 + 3
+	amani.atk = 1
+	assert amani.atk == 1 + 3
+	game.player1.give(MOONFIRE).play(target=amani)
+	assert amani.enraged
+	assert amani.atk == 1 + 3 + 3
+	amani.silence()
+	assert amani.atk == 1
+	assert not amani.windfury
+	# Enrage given back while damaged
+	amani.enrage = True
+	assert amani.enraged
+	assert amani.atk == 1 + 3
+
+	# Script-computed values are never cached
+	giant = game.player1.give("EX1_105")
+	cost = giant.cost
+	assert "cost" not in giant._stat_cache
+	game.player1.give(WISP)
+	assert giant.cost == cost - 1
+
+
 def test_stealth_windfury():
 	game = prepare_game(MAGE, MAGE)
 	worgen = game.current_player.give("EX1_010")
@@ -618,3 +1304,91 @@ def test_taunt():
 	game.end_turn()
 
 	assert wisp2.targets == [goldshire1]
+
+
+def test_track_changes():
+	game = prepare_game()
+	wisp1 = game.player1.give(WISP)
+	wisp2 = game.player1.give(WISP)
+	checkpoint = game.checkpoint()
+	game.track_changes()
+	game.flush_changes()
+	assert not game.flush_changes()
+
+	wisp1.play()
+	changes = game.flush_changes()
+	assert any(entity is wisp1 for entity in changes)
+	# wisp2 moves up in hand
+	assert any(entity is wisp2 for entity in changes)
+	assert not any(entity is game.player2.hero for entity in changes)
+
+	# Buffs change the stats of their owner
+	game.player1.give("CS2_122").play()
+	assert any(entity is wisp1 for entity in game.flush_changes())
+
+	# Clones track their own entities, including the pending changes
+	wisp2.play()
+	clone = game.clone()
+	game.flush_changes()
+	assert all(key == id(entity) for key, entity in clone._changes.items())
+	changes = clone.flush_changes()
+	assert any(entity is clone.entity(wisp2.entity_id) for entity in changes)
+	assert all(entity is clone.entity(entity.entity_id) for entity in changes)
+	clone.entity(wisp1.entity_id).destroy()
+	assert any(entity is clone.entity(wisp1.entity_id) for entity in clone.flush_changes())
+	assert not any(entity is wisp1 for entity in game.flush_changes())
+
+	game.rollback(checkpoint)
+	assert wisp1.zone == Zone.HAND
+	changes = game.flush_changes()
+	assert any(entity is game.player2.hero for entity in changes)
+	assert not game.flush_changes()
+
+	# Changes made while journaling are tracked as well
+	checkpoint = game.checkpoint()
+	wisp2.play()
+	assert any(entity is wisp2 for entity in game.flush_changes())
+	game.rollback(checkpoint)
+
+	# Other games are not tracked
+	untracked = prepare_game()
+	untracked.player1.give(WISP).play()
+	assert untracked._changes is None
+	assert not untracked.flush_changes()
+
+	game.untrack_changes()
+	wisp1.play()
+	assert not game.flush_changes()
+
+
+def test_zone_caches():
+	game = prepare_game()
+	board = game.board
+	characters = game.player1.characters
+	assert game.board is board
+	assert game.player1.characters is characters
+	assert len(characters) == 1
+
+	wisp = game.player1.give(WISP)
+	assert game.board is board
+	assert wisp in game.hands
+	entities = game.player2.entities
+	wisp.play()
+	assert game.player2.entities is entities
+	assert game.board is not board
+	assert game.board == [wisp]
+	assert wisp not in game.hands
+	assert game.player1.characters == [game.player1.hero, wisp]
+	assert not board
+
+	wisp.destroy()
+	assert not game.board
+	assert wisp in game.graveyard
+	assert len(game.player1.characters) == 1
+
+	# Buffs are listed with the minion they are on, whoever played them
+	enemy = game.player2.summon(WISP)
+	game.player1.give("CS2_087").play(target=enemy)
+	assert enemy.buffs
+	assert enemy.buffs[0] in game.player2.entities
+	assert enemy.buffs[0] not in game.player1.entities
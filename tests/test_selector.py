@@ -1,6 +1,7 @@
 #!/usr/bin/env python
-from fireplace.dsl.selector import Selector
 from utils import *
+from fireplace.dsl.selector import *
+from fireplace.utils import CardList
 
 
 def test_selector():
@@ -27,6 +28,31 @@ def test_empty_selector():
 	assert not targets
 
 
+def test_compiled_selector():
+	game = prepare_game()
+	wisp = game.player1.give(WISP)
+	wisp.play()
+	alex = game.player1.summon("EX1_561")
+	game.player1.give(WISP).play()
+	game.end_turn()
+	game.player2.give(WISP).play()
+
+	selectors = (
+		ALL_MINIONS, ENEMY_CHARACTERS, FRIENDLY_MINIONS - SELF, CONTROLLER_HAND + DRAGON,
+		IN_PLAY + (DRAGON | MINION - Selector(Race.DRAGON)), ATK >= 2, COST == 9,
+		AdjacentSelector(ID("EX1_561")), ALL_MINIONS + AdjacentSelector(ID("EX1_561")),
+		ALL_MINIONS - AdjacentSelector(ID("EX1_561")),
+	)
+	for selector in selectors:
+		targets = selector.eval(game, alex)
+		assert targets == selector.interpret(game, alex)
+	assert len(AdjacentSelector(ID("EX1_561")).eval(game, alex)) == 2
+	targets = (ALL_MINIONS - AdjacentSelector(ID("EX1_561"))).eval(game, alex)
+	assert len(targets) == 2
+	assert alex in targets
+	assert wisp not in CardList(targets)
+
+
 def main():
 	for name, f in globals().items():
 		if name.startswith("test_") and callable(f):